@@ -0,0 +1,242 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from database import (
+    validate_patient_record, get_logs_page, get_daily_activity, get_log_count, get_action_count, get_activity_alerts
+)
+from shard_utils import (
+    init_shards, get_patients_page, search_patients, get_diagnosis_counts, register_patient
+)
+from auth import (
+    authenticate_user, check_role, log_user_action,
+    create_session, validate_session, revoke_session
+)
+from crypto_utils import get_cipher
+from export_utils import get_export_columns, iter_csv_bytes
+
+# Headless JSON API for integrations; run with: python api.py
+# Plain HTTP with bearer tokens: local only unless HMS_API_HOST opts in (put TLS in front)
+API_HOST = os.environ.get("HMS_API_HOST", "127.0.0.1")
+API_PORT = 8502
+DB_WORKERS = 16  # bounded pool for blocking database/crypto calls
+MAX_PAGE_SIZE = 500
+
+_db_pool = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="api-db")
+
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking database call on the bounded worker pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_pool, lambda: func(*args, **kwargs))
+
+
+def json_response(data, status=200):
+    return web.json_response(data, status=status, dumps=lambda d: json.dumps(d, default=str))
+
+
+def bad_request(message):
+    """400 with a JSON error body"""
+    return web.HTTPBadRequest(text=json.dumps({'error': message}), content_type='application/json')
+
+
+def rows_to_dicts(rows, columns=None):
+    """sqlite3.Row list -> list of dicts, optionally projected to columns"""
+    if columns is None:
+        return [dict(row) for row in rows]
+    return [{c: row[c] for c in columns if c in row.keys()} for row in rows]
+
+
+def get_page_size(request, default=100):
+    try:
+        size = int(request.query.get('page_size', default))
+    except ValueError:
+        raise bad_request("page_size must be an integer")
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+async def read_json_object(request):
+    """Request body as a JSON object, or 400"""
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise bad_request("Request body must be valid JSON")
+    if not isinstance(body, dict):
+        raise bad_request("Request body must be a JSON object")
+    return body
+
+
+async def get_session(request, roles):
+    """Resolve the bearer token to a session_state-like dict and enforce RBAC"""
+    header = request.headers.get('Authorization', '')
+    token = header[7:] if header.startswith('Bearer ') else None
+    user = await run_db(validate_session, token)
+    if user is None:
+        raise web.HTTPUnauthorized(text="Missing, invalid or expired session token")
+    session = {'user': user, 'session_token': token}
+    if not await run_db(check_role, session, roles):
+        raise web.HTTPForbidden(text="Role not permitted")
+    return session
+
+
+# ========== AUTH ==========
+
+async def login(request):
+    body = await read_json_object(request)
+    username, password = body.get('username'), body.get('password')
+    if not isinstance(username, str) or not isinstance(password, str) or not username or not password:
+        raise bad_request("username and password are required")
+    user = await run_db(authenticate_user, username, password)
+    if user is None:
+        raise web.HTTPUnauthorized(text="Invalid credentials")
+    token = await run_db(create_session, user)
+    await run_db(log_user_action, {'user': user}, "LOGIN", f"User {username} logged in via API")
+    return json_response({'token': token, 'user': user})
+
+
+async def logout(request):
+    session = await get_session(request, ['admin', 'doctor', 'receptionist'])
+    await run_db(log_user_action, session, "LOGOUT", "User logged out via API")
+    await run_db(revoke_session, session['session_token'])
+    return json_response({'status': 'logged out'})
+
+
+# ========== PATIENTS ==========
+
+async def list_patients(request):
+    session = await get_session(request, ['admin', 'doctor'])
+    role = session['user']['role']
+    try:
+        page = await run_db(get_patients_page, request.query.get('page_token'), get_page_size(request, 25))
+    except ValueError as e:
+        raise bad_request(str(e))
+    await run_db(log_user_action, session, "API_LIST_PATIENTS", "Listed patients via API")
+    return json_response({
+        'patients': rows_to_dicts(page['rows'], get_export_columns('patients', role)),
+        'next_token': page['next_token'],
+        'total_estimate': page['total'],
+    })
+
+
+async def search(request):
+    session = await get_session(request, ['admin', 'doctor'])
+    try:
+        page = int(request.query.get('page', 0))
+    except ValueError:
+        raise bad_request("page must be an integer")
+    results = await run_db(search_patients, request.query.get('q', ''), session['user']['role'],
+                           page, get_page_size(request, 25))
+    await run_db(log_user_action, session, "API_SEARCH_PATIENTS", "Searched patients via API")
+    return json_response({'patients': rows_to_dicts(results['rows']), 'page': results['page'],
+                          'has_next': results['has_next']})
+
+
+async def create_patient(request):
+    session = await get_session(request, ['admin', 'receptionist'])
+    body = await read_json_object(request)
+    if not all(isinstance(body.get(field), str) for field in ('name', 'contact', 'diagnosis')):
+        raise bad_request("name, contact and diagnosis are required strings")
+    try:
+        name, contact, diagnosis = validate_patient_record(body)
+    except ValueError as e:
+        raise bad_request(str(e))
+    ward = body.get('ward')
+    if ward is not None and not isinstance(ward, str):
+        raise bad_request("ward must be a string")
+    cipher = await run_db(get_cipher)
+    pid = await run_db(register_patient, name, contact, diagnosis, cipher, ward)
+    await run_db(log_user_action, session, "ADD_PATIENT", f"Added patient ID {pid} via API")
+    return json_response({'patient_id': pid}, status=201)
+
+
+# ========== LOGS & STATS ==========
+
+async def list_logs(request):
+    session = await get_session(request, ['admin'])
+    query = request.query
+    try:
+        user_id = int(query['user_id']) if query.get('user_id') else None
+        page = await run_db(
+            get_logs_page, action=query.get('action'), role=query.get('role'), user_id=user_id,
+            start=query.get('start'), end=query.get('end'), page_token=query.get('page_token'),
+            page_size=get_page_size(request)
+        )
+    except ValueError as e:
+        raise bad_request(str(e))
+    await run_db(log_user_action, session, "API_LIST_LOGS", "Listed audit logs via API")
+    return json_response({'logs': rows_to_dicts(page['rows']), 'next_token': page['next_token']})
+
+
+async def stats(request):
+    await get_session(request, ['admin'])
+    diagnoses, activity, total, today, logins, alerts = await asyncio.gather(
+        run_db(get_diagnosis_counts), run_db(get_daily_activity), run_db(get_log_count),
+        run_db(get_action_count), run_db(get_action_count, "LOGIN"), run_db(get_activity_alerts)
+    )
+    return json_response({
+        'diagnosis_counts': {row['diagnosis']: row['patient_count'] for row in diagnoses},
+        'daily_activity': {row['day']: row['log_count'] for row in activity},
+        'total_logs': total,
+        'actions_today': today,
+        'logins_today': logins,
+        'alerts': alerts,
+    })
+
+
+# ========== STREAMING EXPORT ==========
+
+async def stream_csv(request, dataset, roles):
+    session = await get_session(request, roles)
+    role = session['user']['role']
+    await run_db(log_user_action, session, "EXPORT_DATA", f"Streamed {dataset} CSV export via API")
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/csv; charset=utf-8',
+        'Content-Disposition': f'attachment; filename="{dataset}.csv"',
+    })
+    await response.prepare(request)
+    chunks = iter_csv_bytes(dataset, role)
+    try:
+        # Each chunk is read on the DB pool; memory holds one chunk at a time
+        while True:
+            chunk = await run_db(next, chunks, None)
+            if chunk is None:
+                break
+            await response.write(chunk)
+        await response.write_eof()
+    finally:
+        # A client that disconnects mid-stream must not leave the read transaction open
+        await run_db(chunks.close)
+    return response
+
+
+async def export_patients(request):
+    return await stream_csv(request, 'patients', ['admin', 'doctor'])
+
+
+async def export_logs(request):
+    return await stream_csv(request, 'logs', ['admin'])
+
+
+def create_app():
+    """Build the aiohttp application"""
+    init_shards()
+    app = web.Application()
+    app.add_routes([
+        web.post('/api/login', login),
+        web.post('/api/logout', logout),
+        web.get('/api/patients', list_patients),
+        web.post('/api/patients', create_patient),
+        web.get('/api/patients/search', search),
+        web.get('/api/patients/export.csv', export_patients),
+        web.get('/api/logs', list_logs),
+        web.get('/api/logs/export.csv', export_logs),
+        web.get('/api/stats', stats),
+    ])
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host=API_HOST, port=API_PORT)
@@ -1,14 +1,43 @@
+import os
+import json
+from functools import cached_property
 import streamlit as st
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 import plotly.express as px
 import plotly.graph_objects as go
 from database import (
-    init_database, get_all_patients, get_all_logs, 
-    add_patient, update_patient, anonymize_all_patients
+    frame_from_rows, apply_frame_changes,
+    get_daily_activity, get_log_count, get_action_count, get_activity_alerts,
+    get_logs_page, get_log_actions, get_log_roles, get_log_user_count
 )
-from auth import authenticate_user, check_role, log_user_action
-from crypto_utils import get_cipher, mask_name, mask_contact, decrypt_field
+# Patient data goes through the shard router (a pass-through with one shard)
+from shard_utils import (
+    init_shards, get_patients_page, get_patient_count, get_patients_snapshot,
+    get_patients_frame_by_ids, get_changes_since, count_changes_since,
+    update_patient, anonymize_all_patients, count_dirty_patients, get_diagnosis_counts,
+    reencrypt_all_patients, count_patients_pending_reencryption,
+    register_patient, import_patients_csv, search_patients
+)
+from auth import (
+    authenticate_user, check_role, log_user_action,
+    create_session, validate_session, revoke_session
+)
+from crypto_utils import (
+    get_cipher, rotate_key, retire_old_keys, get_keyring, mask_name, mask_contact,
+    decrypt_fields, DecryptedValueCache
+)
+from export_utils import EXPORT_COLUMNS, export_dataset
+from perf_utils import (
+    timed_page, get_query_stats, get_page_stats, get_slowest_queries,
+    get_health_percent, set_jsonl_export, reset_stats
+)
+from cache_utils import read_cache
+from retention_utils import (
+    get_retention_days, set_retention_days, archive_old_logs, maybe_run_retention,
+    list_archive_months, get_archived_logs_page
+)
+from integrity_utils import get_last_checkpoint, start_background_verification, verification_running
 
 # Page configuration with new modern theme
 st.set_page_config(
@@ -218,7 +247,7 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Initialize database on first run
-init_database()
+init_shards()
 
 # Initialize session state
 if 'user' not in st.session_state:
@@ -232,10 +261,27 @@ if 'start_time' not in st.session_state:
 
 # ========== HELPER FUNCTIONS ==========
 
+def get_decrypt_cache():
+    """Per-session cache of decrypted values (admins only)"""
+    if st.session_state.get('decrypt_cache') is None:
+        st.session_state['decrypt_cache'] = DecryptedValueCache()
+    return st.session_state['decrypt_cache']
+
+def wipe_decrypt_cache():
+    """Wipe decrypted values held by this session"""
+    cache = st.session_state.get('decrypt_cache')
+    if cache is not None:
+        cache.wipe()
+    st.session_state['decrypt_cache'] = None
+
 def logout():
     """Logout and clear session"""
     if st.session_state['user']:
         log_user_action(st.session_state, "LOGOUT", "User logged out")
+    wipe_decrypt_cache()
+    clear_synced_views()
+    revoke_session(st.session_state.get('session_token'))
+    st.session_state['session_token'] = None
     st.session_state['user'] = None
     st.session_state['page'] = 'Login'
     st.rerun()
@@ -268,8 +314,73 @@ def convert_row_to_dict(row):
     else:
         return row
 
+DOCTOR_PATIENT_COLUMNS = ('patient_id', 'anonymized_name', 'anonymized_contact', 'diagnosis', 'date_added')
+
+def get_synced_patients(columns=None):
+    """This session's patients DataFrame, kept current from the change feed
+
+    The first call loads the table; later reruns fetch only rows changed
+    since the session's last seen sequence number and apply them as a delta.
+    """
+    views = st.session_state.setdefault('synced_views', {})
+    view = views.get(columns)
+    delta = get_changes_since(view['seq'], 'patients') if view else None
+    if view is None or delta['reset']:
+        seq, frame = get_patients_snapshot(columns)
+        view = views[columns] = {'frame': frame, 'seq': seq}
+    elif delta['upserts'] or delta['deletes']:
+        changed = get_patients_frame_by_ids(delta['upserts'], columns)
+        view['frame'] = apply_frame_changes(view['frame'], changed, delta['deletes'], 'patient_id', 'date_added')
+        view['seq'] = delta['seq']
+    else:
+        view['seq'] = delta['seq']
+    return view['frame']
+
+def get_pending_changes():
+    """Patient changes committed since this session last synced"""
+    views = st.session_state.get('synced_views', {}).values()
+    return max((count_changes_since(view['seq'], 'patients') for view in views), default=0)
+
+def clear_synced_views():
+    st.session_state['synced_views'] = {}
+
+class RerunData:
+    """Datasets for a single script rerun, each loaded lazily and at most once
+
+    Page functions share one instance (see get_data) so a dashboard that
+    renders several sections does not fetch or convert the same rows twice.
+    """
+
+    @cached_property
+    def patient_count(self):
+        return get_patient_count()
+
+    @cached_property
+    def patients(self):
+        """Every patient column as a typed DataFrame (admin/receptionist pages)"""
+        return get_synced_patients()
+
+    @cached_property
+    def anonymized_patients(self):
+        """Only the columns a doctor may see"""
+        return get_synced_patients(DOCTOR_PATIENT_COLUMNS)
+
+    @cached_property
+    def patient_labels(self):
+        """Selectbox label -> row position in patients"""
+        df = self.patients
+        labels = df['patient_id'].astype(str) + " - " + df['anonymized_name'].fillna('Unknown')
+        return dict(zip(labels, range(len(df))))
+
+def get_data():
+    """Data context for the current rerun (created by main)"""
+    if st.session_state.get('rerun_data') is None:
+        st.session_state['rerun_data'] = RerunData()
+    return st.session_state['rerun_data']
+
 # ========== MODERN LOGIN PAGE ==========
 
+@timed_page("login_page")
 def login_page():
     """Modern login page with dark theme design"""
     
@@ -308,6 +419,7 @@ def login_page():
                         user = authenticate_user(username, password)
                         if user:
                             st.session_state['user'] = user
+                            st.session_state['session_token'] = create_session(user)
                             st.session_state['page'] = 'Dashboard'
                             log_user_action(st.session_state, "LOGIN", f"User {username} logged in")
                             st.success(f"🎉 Welcome back, {user['username']}!")
@@ -331,6 +443,7 @@ def login_page():
 
 # ========== MODERN DASHBOARD ==========
 
+@timed_page("dashboard_page")
 def dashboard_page():
     """Modern dashboard with analytics"""
     user = st.session_state['user']
@@ -346,8 +459,7 @@ def dashboard_page():
         st.markdown(create_metric_card("System Uptime", f"{uptime.seconds // 3600}h", "⏱️", "linear-gradient(135deg, #667eea 0%, #764ba2 100%)"), unsafe_allow_html=True)
     
     with col3:
-        patients = get_all_patients()
-        st.markdown(create_metric_card("Total Patients", len(patients), "👥", "linear-gradient(135deg, #a8e6cf 0%, #56ab2f 100%)"), unsafe_allow_html=True)
+        st.markdown(create_metric_card("Total Patients", get_data().patient_count, "👥", "linear-gradient(135deg, #a8e6cf 0%, #56ab2f 100%)"), unsafe_allow_html=True)
     
     st.markdown("---")
     
@@ -361,19 +473,26 @@ def dashboard_page():
     
     log_user_action(st.session_state, "VIEW_DASHBOARD", "Accessed dashboard")
 
+@timed_page("admin_dashboard")
 def admin_dashboard():
-    """Admin-specific dashboard"""
-    patients = get_all_patients()
-    logs = get_all_logs()
+    """Admin-specific dashboard, drawn from pre-aggregated rollups"""
+    diagnosis_counts = frame_from_rows(get_diagnosis_counts())
+    daily_activity = frame_from_rows(get_daily_activity())
     
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        st.markdown(create_metric_card("Audit Logs", len(logs), "📜", "linear-gradient(135deg, #ff6b6b 0%, #ee5a24 100%)"), unsafe_allow_html=True)
+        st.markdown(create_metric_card("Audit Logs", get_log_count(), "📜", "linear-gradient(135deg, #ff6b6b 0%, #ee5a24 100%)"), unsafe_allow_html=True)
     with col2:
-        st.markdown(create_metric_card("Today's Logins", "12", "👤", "linear-gradient(135deg, #fad0c4 0%, #ffd1ff 100%)"), unsafe_allow_html=True)
+        st.markdown(create_metric_card("Today's Logins", get_action_count("LOGIN"), "👤", "linear-gradient(135deg, #fad0c4 0%, #ffd1ff 100%)"), unsafe_allow_html=True)
     with col3:
-        st.markdown(create_metric_card("System Health", "100%", "💚", "linear-gradient(135deg, #a8e6cf 0%, #56ab2f 100%)"), unsafe_allow_html=True)
+        health = get_health_percent()
+        health_display = f"{health:.0f}%" if health is not None else "N/A"
+        st.markdown(create_metric_card("System Health", health_display, "💚", "linear-gradient(135deg, #a8e6cf 0%, #56ab2f 100%)"), unsafe_allow_html=True)
+    
+    for alert in get_activity_alerts():
+        icon = "🚨" if alert['kind'] == 'rate' else "📈"
+        st.warning(f"{icon} {alert['message']}")
     
     # Charts
     col1, col2 = st.columns(2)
@@ -381,62 +500,43 @@ def admin_dashboard():
     with col1:
         st.markdown('<div class="card">', unsafe_allow_html=True)
         st.subheader("📊 Patient Statistics")
-        if patients:
-            # Convert rows to dictionaries safely
-            patient_dicts = [convert_row_to_dict(p) for p in patients]
-            df = pd.DataFrame(patient_dicts)
-            if not df.empty:
-                fig = px.pie(df, names='diagnosis', title="Diagnosis Distribution")
-                fig.update_layout(
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    font_color='white'
-                )
-                st.plotly_chart(fig, use_container_width=True)
+        if not diagnosis_counts.empty:
+            fig = px.pie(diagnosis_counts, names='diagnosis', values='patient_count',
+                         title="Diagnosis Distribution")
+            fig.update_layout(
+                plot_bgcolor='rgba(0,0,0,0)',
+                paper_bgcolor='rgba(0,0,0,0)',
+                font_color='white'
+            )
+            st.plotly_chart(fig, use_container_width=True)
         st.markdown('</div>', unsafe_allow_html=True)
     
     with col2:
         st.markdown('<div class="card">', unsafe_allow_html=True)
         st.subheader("📈 Activity Timeline")
-        if logs:
-            # Convert rows to dictionaries safely
-            log_dicts = [convert_row_to_dict(log) for log in logs]
-            log_df = pd.DataFrame(log_dicts)
-            if not log_df.empty and 'timestamp' in log_df.columns:
-                log_df['timestamp'] = pd.to_datetime(log_df['timestamp'])
-                daily_activity = log_df.groupby(log_df['timestamp'].dt.date).size()
-                fig = px.line(x=daily_activity.index, y=daily_activity.values, 
-                             title="Daily Activity", labels={'x': 'Date', 'y': 'Actions'})
-                fig.update_layout(
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    font_color='white'
-                )
-                st.plotly_chart(fig, use_container_width=True)
+        if not daily_activity.empty:
+            fig = px.line(daily_activity, x='day', y='log_count',
+                         title="Daily Activity", labels={'day': 'Date', 'log_count': 'Actions'})
+            fig.update_layout(
+                plot_bgcolor='rgba(0,0,0,0)',
+                paper_bgcolor='rgba(0,0,0,0)',
+                font_color='white'
+            )
+            st.plotly_chart(fig, use_container_width=True)
         st.markdown('</div>', unsafe_allow_html=True)
 
+@timed_page("doctor_dashboard")
 def doctor_dashboard():
     """Doctor-specific dashboard"""
-    patients = get_all_patients()
+    data = get_data()
     
     col1, col2 = st.columns(2)
     
     with col1:
         st.markdown('<div class="card">', unsafe_allow_html=True)
         st.subheader("🩺 My Patients")
-        if patients:
-            # Convert rows to dictionaries safely
-            patient_dicts = [convert_row_to_dict(p) for p in patients]
-            df = pd.DataFrame(patient_dicts)
-            if not df.empty:
-                # Safely access columns
-                display_columns = []
-                for col in ['anonymized_name', 'anonymized_contact', 'diagnosis', 'date_added']:
-                    if col in df.columns:
-                        display_columns.append(col)
-                
-                if display_columns:
-                    st.dataframe(df[display_columns], use_container_width=True, height=300)
+        if data.patient_count:
+            st.dataframe(data.anonymized_patients, use_container_width=True, height=300, hide_index=True)
         else:
             st.info("No patients in the system")
         st.markdown('</div>', unsafe_allow_html=True)
@@ -454,6 +554,7 @@ def doctor_dashboard():
         
         st.markdown('</div>', unsafe_allow_html=True)
 
+@timed_page("receptionist_dashboard")
 def receptionist_dashboard():
     """Receptionist-specific dashboard - Alice can only add/edit patients"""
     st.markdown('<div class="card">', unsafe_allow_html=True)
@@ -486,6 +587,7 @@ def receptionist_dashboard():
 
 # ========== MODERN PATIENTS PAGE ==========
 
+@timed_page("patients_page")
 def patients_page():
     """Modern patient management interface"""
     user = st.session_state['user']
@@ -514,24 +616,10 @@ def patients_page():
         with tab3:
             update_patient_tab()
 
-def view_patients_tab():
-    """Modern patient viewing interface"""
-    patients = get_all_patients()
-    user = st.session_state['user']
-    
-    if not patients:
-        st.info("🎯 No patients found. Start by adding your first patient!")
-        return
-    
-    # Role-based view
-    if user['role'] == 'admin':
-        view_mode = st.radio("🔍 View Mode:", ["Anonymized", "Raw Data"], horizontal=True, label_visibility="collapsed")
-        show_raw = view_mode == "Raw Data"
-    else:
-        show_raw = False
-        st.info("👁️ Viewing anonymized patient data (GDPR Compliant)")
-    
-    # Patient cards grid
+PATIENTS_PAGE_SIZE = 25
+
+def render_patient_cards(patients, show_raw):
+    """Render patient rows as cards"""
     for patient in patients:
         with st.container():
             st.markdown('<div class="card">', unsafe_allow_html=True)
@@ -566,6 +654,84 @@ def view_patients_tab():
             
             st.markdown('</div>', unsafe_allow_html=True)
 
+def search_results(query, show_raw):
+    """Ranked full-text search results, one page at a time"""
+    user = st.session_state['user']
+    if st.session_state.get('patient_search_query') != query:
+        st.session_state['patient_search_query'] = query
+        st.session_state['patient_search_page'] = 0
+    page_number = st.session_state['patient_search_page']
+    
+    results = search_patients(query, user['role'], page_number, PATIENTS_PAGE_SIZE)
+    if not results['rows']:
+        st.info("🔎 No matching patients")
+        return
+    
+    render_patient_cards(results['rows'], show_raw)
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("⬅️ Previous", key="search_prev", disabled=page_number == 0, use_container_width=True):
+            st.session_state['patient_search_page'] -= 1
+            st.rerun()
+    with col2:
+        st.markdown(f"<div style='text-align: center; color: #8892b0;'>Results page {page_number + 1}</div>", unsafe_allow_html=True)
+    with col3:
+        if st.button("Next ➡️", key="search_next", disabled=not results['has_next'], use_container_width=True):
+            st.session_state['patient_search_page'] += 1
+            st.rerun()
+
+@timed_page("view_patients_tab")
+def view_patients_tab():
+    """Modern patient viewing interface, one keyset page at a time"""
+    user = st.session_state['user']
+    
+    # Role-based view
+    if user['role'] == 'admin':
+        view_mode = st.radio("🔍 View Mode:", ["Anonymized", "Raw Data"], horizontal=True, label_visibility="collapsed")
+        show_raw = view_mode == "Raw Data"
+    else:
+        show_raw = False
+        st.info("👁️ Viewing anonymized patient data (GDPR Compliant)")
+        with st.expander("💾 Export anonymized records"):
+            export_panel("doctor_export")
+    
+    query = st.text_input("🔎 Search", placeholder="Diagnosis, ANON_0042 or last digits of contact")
+    if query.strip():
+        search_results(query.strip(), show_raw)
+        return
+    
+    # Stack of page tokens so "Previous" can walk back through visited pages
+    if 'patient_page_tokens' not in st.session_state:
+        st.session_state['patient_page_tokens'] = [None]
+    tokens = st.session_state['patient_page_tokens']
+    
+    page = get_patients_page(tokens[-1], PATIENTS_PAGE_SIZE)
+    patients = page['rows']
+    
+    if not patients:
+        if len(tokens) > 1:
+            st.session_state['patient_page_tokens'] = [None]
+            st.rerun()
+        st.info("🎯 No patients found. Start by adding your first patient!")
+        return
+    
+    render_patient_cards(patients, show_raw)
+    
+    # Pagination controls
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("⬅️ Previous", disabled=len(tokens) == 1, use_container_width=True):
+            tokens.pop()
+            st.rerun()
+    with col2:
+        st.markdown(f"<div style='text-align: center; color: #8892b0;'>Page {len(tokens)} • ~{page['total']} patients</div>", unsafe_allow_html=True)
+    with col3:
+        if st.button("Next ➡️", disabled=page['next_token'] is None, use_container_width=True):
+            tokens.append(page['next_token'])
+            st.rerun()
+
+@timed_page("add_patient_tab")
 def add_patient_tab():
     """Modern patient addition form"""
     user = st.session_state['user']
@@ -593,21 +759,35 @@ def add_patient_tab():
         if submitted:
             if all([name, contact, diagnosis]):
                 with st.spinner("🔐 Securing patient data..."):
-                    cipher = get_cipher()
-                    anon_name = mask_name(999)
-                    anon_contact = mask_contact(contact)
-                    enc_name = cipher.encrypt(name.encode()).decode()
-                    enc_contact = cipher.encrypt(contact.encode()).decode()
-                    
-                    pid = add_patient(name, contact, diagnosis, anon_name, anon_contact, enc_name, enc_contact)
-                    update_patient(pid, name, contact, diagnosis, mask_name(pid), anon_contact)
+                    pid = register_patient(name, contact, diagnosis, get_cipher())
                     
                     log_user_action(st.session_state, "ADD_PATIENT", f"Added patient ID {pid}")
                     st.success(f"✅ Patient registered successfully! ID: {pid}")
                     st.balloons()
             else:
                 st.error("❌ Please fill all required fields")
+    st.markdown('</div>', unsafe_allow_html=True)
+    
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    with st.expander("📥 Bulk Import from CSV"):
+        st.caption("CSV columns: name, contact, diagnosis. Records are validated, encrypted and inserted in chunks.")
+        uploaded = st.file_uploader("Patient CSV", type=["csv"], key="bulk_import_csv")
+        if uploaded is not None and st.button("📥 Import Patients", use_container_width=True):
+            with st.spinner("🔐 Importing and securing records..."):
+                try:
+                    result = import_patients_csv(uploaded, get_cipher())
+                except ValueError as e:
+                    st.error(f"❌ {e}")
+                    result = None
+            if result:
+                log_user_action(st.session_state, "IMPORT_PATIENTS", f"Imported {result['imported']} patients from {uploaded.name} ({result['skipped']} skipped)")
+                st.success(f"✅ Imported {result['imported']} patients in {result['seconds']:.1f}s ({result['rows_per_sec']:,.0f} rows/s)")
+                if result['errors']:
+                    st.warning(f"⚠️ {result['skipped']} invalid record(s) skipped")
+                    st.dataframe(pd.DataFrame(result['errors'][:1000], columns=['record', 'error']), use_container_width=True)
+    st.markdown('</div>', unsafe_allow_html=True)
 
+@timed_page("update_patient_tab")
 def update_patient_tab():
     """Modern patient update interface"""
     user = st.session_state['user']
@@ -617,30 +797,18 @@ def update_patient_tab():
         st.error("🚫 Access denied. Only receptionists and admins can update patients.")
         return
     
-    patients = get_all_patients()
-    if not patients:
+    data = get_data()
+    if not data.patient_count:
         st.info("No patients available to update.")
         return
     
     st.markdown('<div class="card">', unsafe_allow_html=True)
     st.subheader("✏️ Update Patient Record")
     
-    # Convert to dictionaries for safe access
-    patient_dicts = [convert_row_to_dict(p) for p in patients]
-    patient_options = {f"{p['patient_id']} - {p.get('anonymized_name', 'Unknown')}": p['patient_id'] for p in patient_dicts}
-    
-    if not patient_options:
-        st.info("No patients available for update.")
-        return
-        
+    patient_options = data.patient_labels
     selected_display = st.selectbox("🔍 Select Patient", list(patient_options.keys()))
-    selected_id = patient_options[selected_display]
-    
-    selected_patient = next((p for p in patient_dicts if p['patient_id'] == selected_id), None)
-    
-    if not selected_patient:
-        st.error("Patient not found")
-        return
+    selected_patient = data.patients.iloc[patient_options[selected_display]]
+    selected_id = int(selected_patient['patient_id'])
     
     with st.form("update_patient_form"):
         col1, col2 = st.columns(2)
@@ -664,6 +832,7 @@ def update_patient_tab():
 
 # ========== MODERN ANONYMIZATION PAGE ==========
 
+@timed_page("anonymization_page")
 def anonymization_page():
     """Modern data protection interface"""
     if not check_role(st.session_state, ['admin']):
@@ -678,13 +847,17 @@ def anonymization_page():
         st.markdown('<div class="card">', unsafe_allow_html=True)
         st.subheader("🔒 Batch Anonymization")
         st.info("Apply GDPR-compliant anonymization to all patient records")
+        st.caption(f"📝 {count_dirty_patients()} new or changed records pending")
+        full_run = st.checkbox("Re-encrypt every record (full run)")
         
         if st.button("🛡️ Secure All Data", use_container_width=True):
             with st.spinner("Applying advanced encryption..."):
                 cipher = get_cipher()
-                anonymize_all_patients(cipher)
-                log_user_action(st.session_state, "ANONYMIZE_ALL", "Batch anonymization applied")
+                result = anonymize_all_patients(cipher, only_dirty=not full_run)
+                resumed = " (resumed interrupted run)" if result['resumed'] else ""
+                log_user_action(st.session_state, "ANONYMIZE_ALL", f"Batch anonymization applied to {result['rows']} patients{resumed}")
                 st.success("🎉 All patient data secured with military-grade encryption!")
+                st.caption(f"⚡ {result['rows']} records in {result['seconds']:.2f}s ({result['rows_per_sec']:,.0f} rows/s){resumed}")
         st.markdown('</div>', unsafe_allow_html=True)
     
     with col2:
@@ -692,101 +865,333 @@ def anonymization_page():
         st.subheader("🔓 Secure Decryption")
         st.warning("Admin-only decryption with audit trail")
         
-        patients = get_all_patients()
-        if patients:
-            patient_dicts = [convert_row_to_dict(p) for p in patients]
-            patient_options = {f"{p['patient_id']} - {p.get('anonymized_name', 'Unknown')}": p for p in patient_dicts}
+        data = get_data()
+        if data.patient_count:
+            patient_options = data.patient_labels
+            selected_displays = st.multiselect("Select Encrypted Records", list(patient_options.keys()))
+            selected = data.patients.iloc[[patient_options[d] for d in selected_displays]]
             
-            if patient_options:
-                selected_display = st.selectbox("Select Encrypted Record", list(patient_options.keys()))
-                selected_patient = patient_options[selected_display]
+            if st.button("🔍 Decrypt Records", disabled=selected.empty, use_container_width=True):
+                cipher = get_cipher()
+                cache = get_decrypt_cache()
+                # Names and contacts go through the pool as one batch
+                values = selected['encrypted_name'].fillna('').tolist() + \
+                         selected['encrypted_contact'].fillna('').tolist()
+                decrypted = decrypt_fields(cipher, values, cache)
+                count = len(selected)
                 
-                if st.button("🔍 Decrypt Record", use_container_width=True):
-                    cipher = get_cipher()
-                    decrypted_name = decrypt_field(cipher, selected_patient.get('encrypted_name', ''))
-                    decrypted_contact = decrypt_field(cipher, selected_patient.get('encrypted_contact', ''))
-                    
-                    st.success("Decrypted Data:")
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.info(f"**Name:** {decrypted_name}")
-                    with col2:
-                        st.info(f"**Contact:** {decrypted_contact}")
-                    
-                    log_user_action(st.session_state, "DECRYPT_DATA", f"Decrypted patient ID {selected_patient.get('patient_id', 'Unknown')}")
+                st.success("Decrypted Data:")
+                st.dataframe(pd.DataFrame({
+                    'patient_id': selected['patient_id'].to_numpy(),
+                    'name': decrypted[:count],
+                    'contact': decrypted[count:]
+                }), use_container_width=True, hide_index=True)
+                
+                # One aggregated audit entry per batch
+                ids = ", ".join(map(str, selected['patient_id']))
+                log_user_action(st.session_state, "DECRYPT_DATA", f"Decrypted {count} patient(s): IDs {ids}")
         st.markdown('</div>', unsafe_allow_html=True)
+    
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    st.subheader("🔑 Key Rotation")
+    cipher = get_cipher()
+    pending = count_patients_pending_reencryption(cipher.version)
+    old_keys = len(get_keyring()) - 1
+    st.info(f"Primary key version {cipher.version} • {old_keys} older key(s) • {pending} record(s) on older keys")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        if st.button("🔄 Rotate Key", use_container_width=True):
+            version = rotate_key()
+            log_user_action(st.session_state, "KEY_ROTATION", f"Rotated encryption key to version {version}")
+            st.rerun()
+    with col2:
+        if st.button("♻️ Re-encrypt Records", disabled=pending == 0, use_container_width=True):
+            with st.spinner("Re-encrypting records under the new key..."):
+                result = reencrypt_all_patients(cipher)
+            log_user_action(st.session_state, "KEY_ROTATION", f"Re-encrypted {result['rows']} patients to key version {cipher.version}")
+            st.success(f"✅ {result['rows']} records re-encrypted ({result['rows_per_sec']:,.0f} rows/s)")
+    with col3:
+        # Old keys are only safe to drop once nothing is encrypted under them
+        if st.button("🗑️ Retire Old Keys", disabled=pending > 0 or old_keys == 0, use_container_width=True):
+            retired = retire_old_keys()
+            log_user_action(st.session_state, "KEY_ROTATION", f"Retired {retired} old encryption key(s)")
+            st.rerun()
+    st.markdown('</div>', unsafe_allow_html=True)
+    
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    st.subheader("🗄️ Data Retention")
+    st.info("Audit logs older than the retention period move to monthly archive databases (still searchable from the Audit Center)")
+    col1, col2 = st.columns(2)
+    with col1:
+        retention_days = st.number_input("Keep live audit logs for (days)", min_value=1, value=get_retention_days(), step=30)
+        if retention_days != get_retention_days():
+            set_retention_days(retention_days)
+            log_user_action(st.session_state, "UPDATE_RETENTION", f"Log retention set to {retention_days} days")
+    with col2:
+        st.caption(f"📦 {len(list_archive_months())} archived month(s)")
+        if st.button("🗄️ Archive Old Logs Now", use_container_width=True):
+            with st.spinner("Archiving in small batches..."):
+                moved = archive_old_logs(retention_days)
+            log_user_action(st.session_state, "ARCHIVE_LOGS", f"Archived {moved} log entries older than {retention_days} days")
+            st.success(f"✅ Archived {moved} log entries")
+    st.markdown('</div>', unsafe_allow_html=True)
+    
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    st.subheader("💾 Backup & Export")
+    st.info("Stream patients or audit logs to CSV/Parquet for backup and recovery")
+    export_panel("admin_export")
+    st.markdown('</div>', unsafe_allow_html=True)
+
+# ========== BACKUP & EXPORT ==========
+
+def export_panel(key_prefix):
+    """Streaming export of the datasets the current role may see"""
+    user = st.session_state['user']
+    datasets = [d for d, roles in EXPORT_COLUMNS.items() if user['role'] in roles]
+    if not datasets:
+        return
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        dataset = st.selectbox("Dataset", datasets, key=f"{key_prefix}_dataset")
+    with col2:
+        fmt = st.selectbox("Format", ["csv", "csv.gz", "parquet"], key=f"{key_prefix}_format")
+    
+    if st.button("💾 Export", key=f"{key_prefix}_export", use_container_width=True):
+        with st.spinner("Streaming export to disk..."):
+            try:
+                path, rows = export_dataset(dataset, user['role'], fmt)
+            except (RuntimeError, PermissionError) as e:
+                st.error(f"❌ {e}")
+                return
+        log_user_action(st.session_state, "EXPORT_DATA", f"Exported {rows} {dataset} rows as {fmt} to {path}")
+        st.session_state[f"{key_prefix}_last_export"] = path
+        st.success(f"✅ Exported {rows} rows to {path}")
+    
+    path = st.session_state.get(f"{key_prefix}_last_export")
+    if path and os.path.exists(path):
+        st.caption(f"Large exports can be streamed without this step from the API: GET /api/{dataset}/export.csv")
+        # st.download_button holds the whole file in server memory, so only read it when asked
+        if st.button("📦 Prepare download", key=f"{key_prefix}_prepare", use_container_width=True):
+            with open(path, 'rb') as f:
+                data = f.read()
+            st.download_button("⬇️ Download", data, file_name=os.path.basename(path),
+                               key=f"{key_prefix}_download", use_container_width=True,
+                               on_click=st.session_state.pop, args=(f"{key_prefix}_last_export", None))
 
 # ========== MODERN AUDIT LOGS ==========
 
+AUDIT_LOGS_PAGE_SIZE = 100
+
+@timed_page("audit_logs_page")
 def audit_logs_page():
-    """Modern audit logs interface"""
+    """Modern audit logs interface with filtering and paging done in SQL"""
     if not check_role(st.session_state, ['admin']):
         st.error("🚫 Admin access required")
         return
     
     st.markdown(f'<h1 class="main-header">Security Audit Center</h1>', unsafe_allow_html=True)
     
-    logs = get_all_logs()
+    total_logs = get_log_count()
     
-    if not logs:
+    if not total_logs:
         st.info("No audit logs available")
         return
     
-    # Convert to dictionaries safely
-    log_dicts = [convert_row_to_dict(log) for log in logs]
-    log_df = pd.DataFrame(log_dicts)
-    
     # Statistics
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        st.markdown(create_metric_card("Total Logs", len(logs), "📊", "linear-gradient(135deg, #00d2ff 0%, #3a7bd5 100%)"), unsafe_allow_html=True)
+        st.markdown(create_metric_card("Total Logs", total_logs, "📊", "linear-gradient(135deg, #00d2ff 0%, #3a7bd5 100%)"), unsafe_allow_html=True)
     with col2:
-        unique_users = log_df['user_id'].nunique() if 'user_id' in log_df.columns else 0
-        st.markdown(create_metric_card("Unique Users", unique_users, "👥", "linear-gradient(135deg, #ff6b6b 0%, #ee5a24 100%)"), unsafe_allow_html=True)
+        st.markdown(create_metric_card("Unique Users", get_log_user_count(), "👥", "linear-gradient(135deg, #ff6b6b 0%, #ee5a24 100%)"), unsafe_allow_html=True)
     with col3:
-        st.markdown(create_metric_card("Actions Today", "15", "⚡", "linear-gradient(135deg, #fad0c4 0%, #ffd1ff 100%)"), unsafe_allow_html=True)
+        st.markdown(create_metric_card("Actions Today", get_action_count(), "⚡", "linear-gradient(135deg, #fad0c4 0%, #ffd1ff 100%)"), unsafe_allow_html=True)
     with col4:
-        st.markdown(create_metric_card("System Integrity", "100%", "🛡️", "linear-gradient(135deg, #a8e6cf 0%, #56ab2f 100%)"), unsafe_allow_html=True)
+        # Entries added since the last signed checkpoint are re-hashed in the background;
+        # the card shows the latest finished result
+        checkpoint = get_last_checkpoint()
+        start_background_verification()
+        if checkpoint is None:
+            st.markdown(create_metric_card("System Integrity", "⏳ Verifying", "🛡️", "linear-gradient(135deg, #00d2ff 0%, #3a7bd5 100%)"), unsafe_allow_html=True)
+        elif checkpoint['status'] == 'ok' and checkpoint['authentic']:
+            st.markdown(create_metric_card("System Integrity", "✅ Verified", "🛡️", "linear-gradient(135deg, #a8e6cf 0%, #56ab2f 100%)"), unsafe_allow_html=True)
+        elif checkpoint['status'] == 'ok':
+            st.markdown(create_metric_card("System Integrity", "⚠️ Bad signature", "🛡️", "linear-gradient(135deg, #ff6b6b 0%, #ee5a24 100%)"), unsafe_allow_html=True)
+        else:
+            st.markdown(create_metric_card("System Integrity", f"⚠️ Broken at #{checkpoint['broken_log_id']}", "🛡️", "linear-gradient(135deg, #ff6b6b 0%, #ee5a24 100%)"), unsafe_allow_html=True)
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        if checkpoint is None:
+            st.caption("🔗 First hash chain verification is running in the background; refresh to see the result")
+        else:
+            running = " • re-checking in the background" if verification_running() else ""
+            st.caption(f"🔗 Hash chain last checked {checkpoint['checked_at']} • verified through log #{checkpoint['last_log_id']}{running}")
+    with col2:
+        if st.button("🔁 Full Re-verification", use_container_width=True):
+            if start_background_verification(full=True):
+                log_user_action(st.session_state, "VERIFY_AUDIT_LOG", "Started full audit chain verification")
+                st.info("⏳ Re-hashing the entire audit chain in the background; refresh to see the result")
+            else:
+                st.warning("⏳ A verification is already running; try again when it finishes")
+    if checkpoint is not None and checkpoint['status'] != 'ok':
+        st.error(f"🚨 Audit log entry #{checkpoint['broken_log_id']} does not match the hash chain; entries may have been altered or deleted.")
     
     # Filtering
     st.markdown('<div class="card">', unsafe_allow_html=True)
+    source = st.radio("Source", ["Live Logs", "Archived Logs"], horizontal=True, label_visibility="collapsed")
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        actions = ["All"] + list(log_df['action'].unique()) if 'action' in log_df.columns else ["All"]
-        selected_action = st.selectbox("Filter by Action", actions)
+        selected_action = st.selectbox("Filter by Action", ["All"] + get_log_actions())
     
     with col2:
-        roles = ["All"] + list(log_df['role'].unique()) if 'role' in log_df.columns else ["All"]
-        selected_role = st.selectbox("Filter by Role", roles)
+        selected_role = st.selectbox("Filter by Role", ["All"] + get_log_roles())
     
     with col3:
         date_range = st.date_input("Date Range", [])
     
-    # Apply filters
-    filtered_df = log_df.copy()
-    if selected_action != "All" and 'action' in filtered_df.columns:
-        filtered_df = filtered_df[filtered_df['action'] == selected_action]
-    if selected_role != "All" and 'role' in filtered_df.columns:
-        filtered_df = filtered_df[filtered_df['role'] == selected_role]
+    # Date range: start day inclusive, end day inclusive (exclusive next midnight)
+    start = end = None
+    if len(date_range) >= 1:
+        start = f"{date_range[0]:%Y-%m-%d} 00:00:00"
+    if len(date_range) == 2:
+        end = f"{date_range[1] + timedelta(days=1):%Y-%m-%d} 00:00:00"
+    
+    filters = {
+        'source': source,
+        'action': None if selected_action == "All" else selected_action,
+        'role': None if selected_role == "All" else selected_role,
+        'start': start,
+        'end': end
+    }
+    
+    # Reset paging whenever the filters change
+    if st.session_state.get('audit_log_filters') != filters:
+        st.session_state['audit_log_filters'] = filters
+        st.session_state['audit_log_page_tokens'] = [None]
+    tokens = st.session_state['audit_log_page_tokens']
+    
+    query = {k: v for k, v in filters.items() if k != 'source'}
+    if source == "Archived Logs":
+        page = get_archived_logs_page(page_token=tokens[-1], page_size=AUDIT_LOGS_PAGE_SIZE, **query)
+    else:
+        page = get_logs_page(page_token=tokens[-1], page_size=AUDIT_LOGS_PAGE_SIZE, **query)
     
     # Display logs
-    st.dataframe(filtered_df, use_container_width=True, height=400)
+    log_df = frame_from_rows(page['rows'])
+    st.dataframe(log_df, use_container_width=True, height=400)
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("⬅️ Newer", disabled=len(tokens) == 1, use_container_width=True):
+            tokens.pop()
+            st.rerun()
+    with col2:
+        st.markdown(f"<div style='text-align: center; color: #8892b0;'>Page {len(tokens)}</div>", unsafe_allow_html=True)
+    with col3:
+        if st.button("Older ➡️", disabled=page['next_token'] is None, use_container_width=True):
+            tokens.append(page['next_token'])
+            st.rerun()
     st.markdown('</div>', unsafe_allow_html=True)
     
     log_user_action(st.session_state, "VIEW_AUDIT_LOG", "Accessed audit logs")
 
+# ========== PERFORMANCE ==========
+
+@timed_page("performance_page")
+def performance_page():
+    """Admin-only query and page latency panel"""
+    if not check_role(st.session_state, ['admin']):
+        st.error("🚫 Admin access required")
+        return
+    
+    st.markdown('<h1 class="main-header">Performance Monitor</h1>', unsafe_allow_html=True)
+    
+    page_stats = get_page_stats()
+    query_stats = get_query_stats()
+    cache_stats = read_cache.stats()
+    health = get_health_percent()
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.markdown(create_metric_card("System Health", f"{health:.1f}%" if health is not None else "N/A", "💚", "linear-gradient(135deg, #a8e6cf 0%, #56ab2f 100%)"), unsafe_allow_html=True)
+    with col2:
+        st.markdown(create_metric_card("Statements Tracked", len(query_stats), "🗄️", "linear-gradient(135deg, #00d2ff 0%, #3a7bd5 100%)"), unsafe_allow_html=True)
+    with col3:
+        lookups = cache_stats['hits'] + cache_stats['misses']
+        hit_rate = f"{100 * cache_stats['hits'] / lookups:.0f}%" if lookups else "N/A"
+        st.markdown(create_metric_card("Cache Hit Rate", hit_rate, "⚡", "linear-gradient(135deg, #fad0c4 0%, #ffd1ff 100%)"), unsafe_allow_html=True)
+    with col4:
+        st.markdown(create_metric_card("Cached Rows", cache_stats['rows'], "📦", "linear-gradient(135deg, #667eea 0%, #764ba2 100%)"), unsafe_allow_html=True)
+    
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    st.subheader("🖥️ Page Render Times")
+    if page_stats:
+        st.dataframe(pd.DataFrame(page_stats), use_container_width=True)
+    else:
+        st.info("No page renders recorded yet")
+    st.markdown('</div>', unsafe_allow_html=True)
+    
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    st.subheader("🗄️ Statements by p95 Latency")
+    if query_stats:
+        st.dataframe(pd.DataFrame(query_stats[:50]), use_container_width=True, height=300)
+    st.subheader("🐢 Slowest Queries")
+    slowest = get_slowest_queries()
+    if slowest:
+        slowest_df = pd.DataFrame(slowest)
+        slowest_df['at'] = pd.to_datetime(slowest_df['at'], unit='s')
+        st.dataframe(slowest_df, use_container_width=True)
+    st.markdown('</div>', unsafe_allow_html=True)
+    
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    st.subheader("📤 Export")
+    col1, col2 = st.columns(2)
+    with col1:
+        path = st.text_input("JSON-lines file", value=st.session_state.get('perf_export_path', 'perf_samples.jsonl'))
+        if st.button("▶️ Start JSON-lines Export", use_container_width=True):
+            set_jsonl_export(path)
+            st.session_state['perf_export_path'] = path
+            st.success(f"Writing samples to {path}")
+        if st.button("⏹️ Stop Export", use_container_width=True):
+            set_jsonl_export(None)
+    with col2:
+        snapshot = json.dumps({'pages': page_stats, 'queries': query_stats, 'slowest': slowest}, indent=2)
+        st.download_button("⬇️ Download Snapshot", snapshot, file_name="performance.json", use_container_width=True)
+        if st.button("🧹 Reset Statistics", use_container_width=True):
+            reset_stats()
+            st.rerun()
+    st.markdown('</div>', unsafe_allow_html=True)
+
 # ========== MODERN NAVIGATION ==========
 
 def main():
     """Modern navigation system"""
+    # Fresh data context per rerun; datasets load on first use
+    st.session_state['rerun_data'] = RerunData()
+    
+    # Enforce the 30-minute inactivity timeout on every rerun
+    if st.session_state['user'] is not None:
+        if validate_session(st.session_state.get('session_token')) is None:
+            log_user_action(st.session_state, "SESSION_EXPIRED", "Session timed out")
+            wipe_decrypt_cache()
+            clear_synced_views()
+            st.session_state['user'] = None
+            st.session_state['session_token'] = None
+            st.session_state['page'] = 'Login'
+            st.warning("⏰ Your session has expired. Please sign in again.")
     
     if st.session_state['user'] is None:
         login_page()
     else:
         user = st.session_state['user']
         
+        # Automated retention: archives old audit logs in the background at most once a day
+        maybe_run_retention()
+        
         # Modern sidebar
         with st.sidebar:
             st.markdown("""
@@ -815,7 +1220,8 @@ def main():
             if user['role'] == 'admin':
                 nav_items.extend([
                     ("🔐 Data Protection", "Anonymization"),
-                    ("📜 Audit Logs", "Audit Logs")
+                    ("📜 Audit Logs", "Audit Logs"),
+                    ("⚡ Performance", "Performance")
                 ])
             
             for icon, page in nav_items:
@@ -827,7 +1233,9 @@ def main():
             
             # Quick actions
             st.markdown("### ⚡ Quick Actions")
-            if st.button("🔄 Refresh Data", use_container_width=True):
+            # Reruns only apply rows changed since this session's last sync
+            pending = get_pending_changes()
+            if st.button(f"🔄 Sync {pending} Change(s)" if pending else "🔄 Up to Date", disabled=not pending, use_container_width=True):
                 st.rerun()
             
             if st.button("🚪 Sign Out", use_container_width=True):
@@ -853,6 +1261,8 @@ def main():
             anonymization_page()
         elif page == 'Audit Logs':
             audit_logs_page()
+        elif page == 'Performance':
+            performance_page()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,159 @@
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from database import add_logs
+
+# Batching limits for the background audit writer
+QUEUE_SIZE = 10000
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 0.5  # seconds a partial batch may wait before it is written
+WRITE_RETRIES = 3
+SPILL_FILE = "audit_spill.jsonl"  # entries that could not be written, replayed on the next start
+
+_STOP = object()
+
+
+class AuditLogWriter:
+    """Background writer that batches audit entries into executemany transactions (GDPR accountability)"""
+
+    def __init__(self, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._spill_lock = threading.Lock()
+        self.replay_spill()
+        self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id, role, action, details=""):
+        """Queue an entry; falls back to a synchronous write when the queue is full"""
+        entry = (user_id, role, action, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), details)
+        if not self._thread.is_alive():
+            self._write([entry])
+            return
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            # Back-pressure: never drop an audit entry
+            self._write([entry])
+
+    def flush(self):
+        """Block until every queued entry has been written"""
+        self.queue.join()
+
+    def stop(self):
+        """Flush remaining entries and stop the worker thread"""
+        if self._thread.is_alive():
+            self.queue.put(_STOP)
+            self._thread.join()
+
+    def replay_spill(self):
+        """Retry entries spilled by an earlier failed write; anything still failing is spilled again"""
+        replaying = SPILL_FILE + ".replay"
+        try:
+            os.replace(SPILL_FILE, replaying)
+        except FileNotFoundError:
+            return
+        with open(replaying, encoding="utf-8") as f:
+            entries = [tuple(json.loads(line)) for line in f if line.strip()]
+        if entries:
+            self._write(entries)
+        os.remove(replaying)
+
+    def _run(self):
+        stopping = False
+        while True:
+            batch, taken, stopping = self._collect(stopping)
+            try:
+                if batch:
+                    self._write(batch)
+            finally:
+                for _ in range(taken):
+                    self.queue.task_done()
+            if stopping and not batch:
+                return
+
+    def _collect(self, stopping):
+        """Gather up to batch_size entries, waiting at most flush_interval after the first"""
+        batch = []
+        taken = 0
+        deadline = None
+        while len(batch) < self.batch_size:
+            try:
+                if stopping:
+                    # Shutting down: drain what is already queued without waiting
+                    item = self.queue.get_nowait()
+                elif deadline is None:
+                    item = self.queue.get()
+                    deadline = time.monotonic() + self.flush_interval
+                else:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            taken += 1
+            if item is _STOP:
+                stopping = True
+            else:
+                batch.append(item)
+        return batch, taken, stopping
+
+    def _write(self, batch):
+        """Write a batch; if it keeps failing, write row by row and spill the rows that fail"""
+        for attempt in range(WRITE_RETRIES):
+            try:
+                add_logs(batch)
+                return
+            except sqlite3.OperationalError as e:
+                # Usually "database is locked"; back off and retry
+                error = e
+                time.sleep(0.05 * (attempt + 1))
+            except Exception as e:
+                # A bad entry (constraint, unbindable value) fails the whole transaction; retrying the batch will not help
+                error = e
+                break
+        print(f"Audit log batch write error: {error} ({len(batch)} entries); writing row by row")
+        failed = []
+        for entry in batch:
+            try:
+                add_logs([entry])
+            except Exception as e:
+                print(f"Audit log write error: {e}")
+                failed.append(entry)
+        if failed:
+            self._spill(failed)
+
+    def _spill(self, entries):
+        """Append unwritable entries to SPILL_FILE so they are kept, never dropped"""
+        with self._spill_lock, open(SPILL_FILE, "a", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(list(entry), default=str) + "\n")
+        print(f"Audit log: {len(entries)} entries spilled to {SPILL_FILE}")
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_audit_writer():
+    """Return the process-wide audit writer, starting it on first use"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = AuditLogWriter()
+            atexit.register(_writer.stop)
+        return _writer
+
+
+def shutdown_audit_writer():
+    """Flush and stop the process-wide writer (flush-on-shutdown guarantee)"""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.stop()
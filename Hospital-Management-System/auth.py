@@ -1,6 +1,34 @@
+import hashlib
+import secrets
 import sqlite3
+import threading
+import time
 import bcrypt
-from database import get_db_connection, add_log
+from concurrent.futures import ThreadPoolExecutor
+from database import (
+    get_db_connection, add_log, create_session_record, get_session_record,
+    extend_session_record, delete_session_record, sweep_expired_sessions
+)
+from audit_writer import get_audit_writer
+
+SESSION_TIMEOUT = 30 * 60  # seconds of inactivity before a session expires
+SESSION_TOUCH_INTERVAL = 60  # persist sliding expiry at most this often per session
+SESSION_SWEEP_INTERVAL = 300
+LOGIN_WORKERS = 4  # concurrent bcrypt checks; bursts queue instead of starving reruns
+
+_login_pool = ThreadPoolExecutor(max_workers=LOGIN_WORKERS, thread_name_prefix="bcrypt-login")
+
+# token hash -> [user dict, expires_at, last persisted expiry]
+_sessions = {}
+_sessions_lock = threading.Lock()
+_last_sweep = 0
+
+# Security-critical actions are written synchronously and never queued
+MUST_PERSIST_ACTIONS = {
+    "LOGIN", "LOGOUT", "DECRYPT_DATA", "ANONYMIZE_ALL",
+    "ADD_PATIENT", "UPDATE_PATIENT", "IMPORT_PATIENTS", "EXPORT_DATA", "KEY_ROTATION",
+    "UPDATE_RETENTION", "ARCHIVE_LOGS", "VERIFY_AUDIT_LOG"
+}
 
 def authenticate_user(username, password):
     """Authenticate user with bcrypt hashing (CIA confidentiality)"""
@@ -10,7 +38,8 @@ def authenticate_user(username, password):
             cursor.execute("SELECT user_id, username, password_hash, role FROM users WHERE username=?", (username,))
             user = cursor.fetchone()
             
-            if user and bcrypt.checkpw(password.encode('utf-8'), user['password_hash']):
+            # bcrypt runs on the bounded login pool (it releases the GIL while hashing)
+            if user and _login_pool.submit(bcrypt.checkpw, password.encode('utf-8'), user['password_hash']).result():
                 return {
                     'user_id': user['user_id'],
                     'username': user['username'],
@@ -21,14 +50,88 @@ def authenticate_user(username, password):
         print(f"Authentication error: {e}")
         return None
 
+def _hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def create_session(user):
+    """Start a server-side session and return its opaque token (only the hash is stored)"""
+    token = secrets.token_urlsafe(32)
+    token_hash = _hash_token(token)
+    now = int(time.time())
+    expires_at = now + SESSION_TIMEOUT
+    create_session_record(token_hash, user['user_id'], now, expires_at)
+    with _sessions_lock:
+        _sessions[token_hash] = [dict(user), expires_at, expires_at]
+    return token
+
+def validate_session(token):
+    """Return the session's user and slide its expiry, or None if unknown or expired
+
+    Hits are served from the in-process map; the database is consulted only
+    on a miss (e.g. after a restart) and written at most once per
+    SESSION_TOUCH_INTERVAL per session.
+    """
+    if not token:
+        return None
+    token_hash = _hash_token(token)
+    now = int(time.time())
+    _maybe_sweep(now)
+    with _sessions_lock:
+        entry = _sessions.get(token_hash)
+    if entry is None:
+        record = get_session_record(token_hash, now)
+        if record is None:
+            return None
+        user = {'user_id': record['user_id'], 'username': record['username'], 'role': record['role']}
+        entry = [user, record['expires_at'], record['expires_at']]
+        with _sessions_lock:
+            _sessions[token_hash] = entry
+    if entry[1] <= now:
+        revoke_session(token)
+        return None
+    entry[1] = now + SESSION_TIMEOUT
+    if entry[1] - entry[2] >= SESSION_TOUCH_INTERVAL:
+        entry[2] = entry[1]
+        extend_session_record(token_hash, entry[1])
+    return entry[0]
+
+def revoke_session(token):
+    """End a session (logout or expiry)"""
+    if not token:
+        return
+    token_hash = _hash_token(token)
+    with _sessions_lock:
+        _sessions.pop(token_hash, None)
+    delete_session_record(token_hash)
+
+def _maybe_sweep(now):
+    """Batched expiry sweep, run at most once per SESSION_SWEEP_INTERVAL"""
+    global _last_sweep
+    if now - _last_sweep < SESSION_SWEEP_INTERVAL:
+        return
+    _last_sweep = now
+    with _sessions_lock:
+        expired = [h for h, entry in _sessions.items() if entry[1] <= now]
+        for token_hash in expired:
+            del _sessions[token_hash]
+    # Grace of one touch interval: the stored expiry may lag the in-memory one
+    sweep_expired_sessions(now - SESSION_TOUCH_INTERVAL)
+
 def check_role(session_state, required_roles):
     """RBAC middleware - restrict access by role (CIA confidentiality & integrity)"""
     if 'user' not in session_state or session_state['user'] is None:
         return False
-    return session_state['user']['role'] in required_roles
+    user = validate_session(session_state.get('session_token'))
+    if user is None:
+        return False
+    return user['role'] in required_roles
 
 def log_user_action(session_state, action, details=""):
     """Log user actions for audit trail (GDPR accountability)"""
     if 'user' in session_state and session_state['user']:
         user = session_state['user']
-        add_log(user['user_id'], user['role'], action, details)
+        if action in MUST_PERSIST_ACTIONS:
+            add_log(user['user_id'], user['role'], action, details)
+        else:
+            # Routine views (VIEW_DASHBOARD, VIEW_AUDIT_LOG) go through the batched writer
+            get_audit_writer().submit(user['user_id'], user['role'], action, details)
@@ -0,0 +1,291 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import database
+
+# Synthetic database sizes: (patients, logs)
+SIZES = {
+    'small': (10000, 100000),
+    'medium': (100000, 1000000),
+    'large': (1000000, 10000000),
+}
+DIAGNOSES = ["Flu", "Diabetes", "Hypertension", "Asthma", "Migraine", "Fracture",
+             "Covid-19", "Allergy", "Anemia", "Bronchitis"]
+ACTIONS = ["LOGIN", "LOGOUT", "VIEW_DASHBOARD", "VIEW_AUDIT_LOG", "ADD_PATIENT",
+           "UPDATE_PATIENT", "DECRYPT_DATA", "ANONYMIZE_ALL"]
+ROLES = ["admin", "doctor", "receptionist"]
+GENERATE_BATCH = 50000
+REGRESSION_THRESHOLD = 1.25  # flag operations that got 25% slower
+
+
+# ========== CONNECTION POOL ==========
+
+def bench_unpooled_connections(iterations=2000):
+    """Baseline: open, configure and close a fresh connection per call (pre-pool behaviour)"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        conn = sqlite3.connect(database.DATABASE, check_same_thread=False)
+        conn.execute("PRAGMA foreign_keys = ON;")
+        conn.row_factory = sqlite3.Row
+        conn.execute("SELECT COUNT(*) FROM patients").fetchone()
+        conn.close()
+    return iterations / (time.perf_counter() - start)
+
+
+def bench_pooled_connections(iterations=2000):
+    """Checkout the pooled connection per call through get_db_connection"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with database.get_db_connection() as conn:
+            conn.execute("SELECT COUNT(*) FROM patients").fetchone()
+    return iterations / (time.perf_counter() - start)
+
+
+def run_connection_benchmark(iterations=2000):
+    """Compare connections per second before and after pooling"""
+    with tempfile.TemporaryDirectory() as tmp:
+        previous = database.DATABASE
+        database.DATABASE = os.path.join(tmp, "bench.db")
+        try:
+            database.init_database()
+            before = bench_unpooled_connections(iterations)
+            after = bench_pooled_connections(iterations)
+        finally:
+            database.close_all_connections()
+            database.DATABASE = previous
+    print(f"Unpooled: {before:,.0f} connections/s")
+    print(f"Pooled:   {after:,.0f} connections/s ({after / before:.1f}x)")
+    return {"unpooled_per_sec": before, "pooled_per_sec": after}
+
+
+# ========== SYNTHETIC DATA ==========
+
+def _batched(rows, size=GENERATE_BATCH):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate_database(path, patients, logs, cipher, seed=42):
+    """Create a synthetic hospital.db at path with the given numbers of patients and logs"""
+    rng = random.Random(seed)
+    database.DATABASE = path
+    database.init_database()
+    start = datetime(2024, 1, 1)
+    # A small pool of real ciphertexts keeps generation fast but decryption realistic
+    encrypted = [(cipher.encrypt(f"Patient {i}".encode()).decode(),
+                  cipher.encrypt(f"555-{i:04d}".encode()).decode()) for i in range(100)]
+
+    def patient_rows():
+        for i in range(patients):
+            enc_name, enc_contact = encrypted[i % len(encrypted)]
+            added = (start + timedelta(seconds=i * 30)).strftime("%Y-%m-%d %H:%M:%S")
+            yield (f"Patient {i}", f"555-{i % 10000:04d}", rng.choice(DIAGNOSES),
+                   enc_name, enc_contact, added, added)
+
+    def log_rows():
+        prev_hash = database.LOG_CHAIN_GENESIS
+        for i in range(logs):
+            stamp = (start + timedelta(seconds=i * 3)).strftime("%Y-%m-%d %H:%M:%S")
+            entry = (rng.randint(1, 3), rng.choice(ROLES), rng.choice(ACTIONS), stamp, "synthetic")
+            entry_hash = database.compute_log_hash(prev_hash, *entry)
+            yield entry + (prev_hash, entry_hash)
+            prev_hash = entry_hash
+
+    with database.get_db_connection() as conn:
+        for batch in _batched(patient_rows()):
+            conn.executemany("""
+                INSERT INTO patients (name, contact, diagnosis, encrypted_name, encrypted_contact,
+                                      date_added, last_updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, batch)
+            conn.commit()
+        for batch in _batched(log_rows()):
+            conn.executemany(
+                """INSERT INTO logs (user_id, role, action, timestamp, details, prev_hash, entry_hash)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                batch
+            )
+            conn.commit()
+        conn.execute("ANALYZE")
+        conn.commit()
+
+
+# ========== TIMING ==========
+
+def time_call(func, repeat):
+    """Run func repeat times and return per-call timings in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(size, name, timings, ops_per_call=1):
+    return {
+        'size': size,
+        'name': name,
+        'repeat': len(timings),
+        'min_s': min(timings),
+        'median_s': statistics.median(timings),
+        'mean_s': statistics.fmean(timings),
+        'ops_per_sec': ops_per_call / statistics.median(timings) if statistics.median(timings) else None,
+    }
+
+
+def run_suite(size, patients, logs, quick=False):
+    """Time every public database, auth and crypto entry point against one synthetic database"""
+    import auth
+    import crypto_utils
+    import integrity_utils
+
+    results = []
+    repeat = 3 if quick else 5
+    with tempfile.TemporaryDirectory() as tmp:
+        previous_db, previous_keys = database.DATABASE, (crypto_utils.KEY_FILE, crypto_utils.KEYRING_FILE)
+        crypto_utils.KEY_FILE = os.path.join(tmp, "fernet.key")
+        crypto_utils.KEYRING_FILE = os.path.join(tmp, "fernet.keys")
+        previous_audit_key, integrity_utils.AUDIT_KEY_FILE = integrity_utils.AUDIT_KEY_FILE, os.path.join(tmp, "audit.key")
+        try:
+            cipher = crypto_utils.get_cipher()
+            started = time.perf_counter()
+            generate_database(os.path.join(tmp, "hospital.db"), patients, logs, cipher)
+            results.append(summarize(size, 'generate_database', [time.perf_counter() - started], patients + logs))
+
+            def record(name, func, n=repeat, ops=1):
+                results.append(summarize(size, name, time_call(func, n), ops))
+                print(f"  {size:>6} {name:<34} {results[-1]['median_s'] * 1000:10.3f} ms")
+
+            # database.py: writes
+            record('add_log', lambda: database.add_log(1, 'admin', 'BENCH', 'x'), n=200)
+            batch = [(1, 'admin', 'BENCH', '2024-06-01 00:00:00', 'x')] * 1000
+            record('add_logs[1000]', lambda: database.add_logs(batch), ops=1000)
+            record('register_patient', lambda: database.register_patient('Bench', '555-0000', 'Flu', cipher), n=50)
+            csv_rows = "name,contact,diagnosis\n" + "Bench,555-0000,Flu\n" * 1000
+            record('import_patients_csv[1000]',
+                   lambda: database.import_patients_csv(io.StringIO(csv_rows), cipher), n=repeat, ops=1000)
+            record('update_patient', lambda: database.update_patient(1, 'Bench', '555-0000', 'Flu', 'ANON_0001', 'XXX-XXX-0000'), n=50)
+
+            # database.py: reads (uncached = real query cost, cached = rerun cost)
+            record('get_all_patients', database.get_all_patients.uncached, n=repeat)
+            record('get_all_patients[cached]', database.get_all_patients, n=50)
+            record('get_patients_frame', database.get_patients_frame.uncached, n=repeat)
+            record('get_all_logs', database.get_all_logs.uncached, n=repeat)
+            record('get_patients_page', lambda: database.get_patients_page.uncached(None, 25), n=50)
+            token = database.get_patients_page.uncached(None, 25)['next_token']
+            record('get_patients_page[next]', lambda: database.get_patients_page.uncached(token, 25), n=50)
+            record('get_logs_page', lambda: database.get_logs_page.uncached(page_size=100), n=50)
+            record('get_logs_page[filtered]', lambda: database.get_logs_page.uncached(
+                action='LOGIN', role='admin', start='2024-02-01 00:00:00', page_size=100), n=50)
+            record('get_diagnosis_counts', database.get_diagnosis_counts.uncached, n=50)
+            record('get_daily_activity', database.get_daily_activity.uncached, n=20)
+            record('get_log_count', database.get_log_count.uncached, n=20)
+            record('count_dirty_patients', database.count_dirty_patients, n=repeat)
+
+            # database.py: batch jobs (first run is full, second only sees what changed)
+            record('anonymize_all_patients[full]', lambda: database.anonymize_all_patients(cipher), n=1, ops=patients)
+            database.update_patient(1, 'Bench', '555-0000', 'Flu', 'ANON_0001', 'XXX-XXX-0000')
+            record('anonymize_all_patients[incremental]', lambda: database.anonymize_all_patients(cipher), n=repeat)
+
+            # integrity_utils.py (full chain, then an incremental run over nothing new)
+            record('verify_audit_log[full]', lambda: integrity_utils.verify_audit_log(full=True), n=1, ops=logs)
+            record('verify_audit_log[incremental]', integrity_utils.verify_audit_log, n=repeat)
+
+            # auth.py
+            record('authenticate_user', lambda: auth.authenticate_user('admin', 'admin123'), n=3)
+            user = auth.authenticate_user('admin', 'admin123')
+            session = {'user': user, 'session_token': auth.create_session(user)}
+            record('check_role', lambda: auth.check_role(session, ['admin']), n=1000)
+
+            # crypto_utils.py
+            record('get_cipher', crypto_utils.get_cipher, n=1000)
+            token = cipher.encrypt(b"Patient 1").decode()
+            record('decrypt_field', lambda: crypto_utils.decrypt_field(cipher, token), n=1000)
+            tokens = [cipher.encrypt(f"Patient {i}".encode()).decode() for i in range(500)]
+            record('decrypt_fields[500]', lambda: crypto_utils.decrypt_fields(cipher, tokens), n=repeat, ops=500)
+        finally:
+            database.close_all_connections()
+            database.DATABASE = previous_db
+            crypto_utils.KEY_FILE, crypto_utils.KEYRING_FILE = previous_keys
+            integrity_utils.AUDIT_KEY_FILE = previous_audit_key
+    return results
+
+
+def get_version():
+    """Git revision of the code under test, for tracking results between versions"""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return "unknown"
+
+
+def compare(previous_path, results):
+    """Print operations whose median got slower than REGRESSION_THRESHOLD against a previous run"""
+    with open(previous_path) as f:
+        previous = {(r['size'], r['name']): r for r in json.load(f)['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['size'], result['name']))
+        if before and before['median_s'] and result['median_s'] / before['median_s'] > REGRESSION_THRESHOLD:
+            regressions.append((result['size'], result['name'], before['median_s'], result['median_s']))
+    for size, name, before, after in regressions:
+        print(f"REGRESSION {size} {name}: {before * 1000:.3f} ms -> {after * 1000:.3f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the database, auth and crypto layers on synthetic data")
+    parser.add_argument("--sizes", nargs="+", default=["small"], choices=list(SIZES),
+                        help="synthetic database sizes to run (default: small)")
+    parser.add_argument("--output", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--compare", help="previous JSON results to check for regressions")
+    parser.add_argument("--quick", action="store_true", help="fewer repetitions")
+    parser.add_argument("--connections", action="store_true", help="only run the connection pool benchmark")
+    args = parser.parse_args()
+
+    if args.connections:
+        run_connection_benchmark()
+        return
+
+    results = []
+    for size in args.sizes:
+        patients, logs = SIZES[size]
+        print(f"Benchmarking {size}: {patients:,} patients, {logs:,} logs")
+        results.extend(run_suite(size, patients, logs, args.quick))
+
+    report = {
+        'version': get_version(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'results': results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        if compare(args.compare, results):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Bounds for the shared read cache
+CACHE_MAX_ENTRIES = 128
+CACHE_MAX_ROWS = 200000  # total rows held across all entries
+CACHE_TTL = 300  # seconds; safety net for writes this process cannot see
+
+_generations = {}
+_generation_lock = threading.Lock()
+
+
+def bump_generation(*tables):
+    """Mark tables as changed so cached reads depending on them are invalidated"""
+    with _generation_lock:
+        for table in tables:
+            _generations[table] = _generations.get(table, 0) + 1
+
+
+def bump_all_generations():
+    """Invalidate every table (used when another process wrote to the database)"""
+    with _generation_lock:
+        for table in list(_generations):
+            _generations[table] += 1
+
+
+def get_generations(tables):
+    """Snapshot the generation counters of the given tables"""
+    with _generation_lock:
+        return tuple(_generations.setdefault(table, 0) for table in tables)
+
+
+class ReadCache:
+    """LRU cache of query results versioned by table generation, bounded by entries, rows and TTL"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_rows=CACHE_MAX_ROWS, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (generations, expires_at, size, value)
+        self._rows = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, key, tables, loader):
+        """Return the cached value for key, calling loader() when missing, stale or expired"""
+        generations = get_generations(tables)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == generations and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[3]
+            self.misses += 1
+        # Load outside the lock; the pre-load generations make a racing write invalidate it
+        value = loader()
+        size = len(value) if hasattr(value, '__len__') else 1
+        if size > self.max_rows:
+            return value
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (generations, now + self.ttl, size, value)
+            self._rows += size
+            while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+                self._remove(next(iter(self._entries)))
+        return value
+
+    def clear(self):
+        """Drop every cached entry"""
+        with self._lock:
+            self._entries.clear()
+            self._rows = 0
+
+    def stats(self):
+        """Hit/miss counters and current occupancy"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self._entries), 'rows': self._rows}
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._rows -= entry[2]
+
+
+read_cache = ReadCache()
@@ -1,8 +1,34 @@
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import os
+import threading
+import time
 
 # Generate or load Fernet key (store securely in production - not hardcoded)
 KEY_FILE = "fernet.key"
+# Versioned keyring, one "<version> <key>" per line, primary (newest) first
+KEYRING_FILE = "fernet.keys"
+
+# Bulk decryption: worker pool and per-admin-session cache bounds
+DECRYPT_WORKERS = 4
+DECRYPT_BATCH_INLINE = 32  # smaller batches are not worth a thread hop
+DECRYPT_CACHE_SIZE = 512
+DECRYPT_CACHE_TTL = 300  # seconds
+
+_decrypt_pool = ThreadPoolExecutor(max_workers=DECRYPT_WORKERS, thread_name_prefix="decrypt")
+
+_cipher_lock = threading.Lock()
+_cipher_cache = {}  # (keyring path, mtime) -> VersionedMultiFernet
+
+
+class VersionedMultiFernet(MultiFernet):
+    """MultiFernet that remembers the version of its primary (encrypting) key"""
+
+    def __init__(self, keyring):
+        super().__init__([Fernet(key) for _, key in keyring])
+        self.version = keyring[0][0]
+
 
 def get_or_create_key():
     """Generate or load Fernet encryption key (bonus feature)"""
@@ -15,10 +41,62 @@ def get_or_create_key():
             f.write(key)
         return key
 
+def _write_keyring(keyring):
+    """Atomically replace the keyring file so readers never see a partial write"""
+    tmp = KEYRING_FILE + ".tmp"
+    with open(tmp, 'wb') as f:
+        for version, key in keyring:
+            f.write(f"{version} ".encode() + key.strip() + b"\n")
+    os.replace(tmp, KEYRING_FILE)
+
+def get_keyring():
+    """Return [(version, key), ...] newest first, seeding version 1 from fernet.key"""
+    if not os.path.exists(KEYRING_FILE):
+        _write_keyring([(1, get_or_create_key())])
+    keyring = []
+    with open(KEYRING_FILE, 'rb') as f:
+        for line in f:
+            if line.strip():
+                version, key = line.split(None, 1)
+                keyring.append((int(version), key.strip()))
+    return keyring
+
 def get_cipher():
-    """Return Fernet cipher for reversible encryption (GDPR pseudonymisation Article 4(5))"""
-    key = get_or_create_key()
-    return Fernet(key)
+    """Return the process-wide Fernet cipher for reversible encryption (GDPR pseudonymisation Article 4(5))
+
+    The MultiFernet is built once and reused until the keyring file changes,
+    so rotations made by another process are picked up on the next call.
+    """
+    try:
+        mtime = os.stat(KEYRING_FILE).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    cache_key = (os.path.abspath(KEYRING_FILE), mtime)
+    cipher = _cipher_cache.get(cache_key)
+    if cipher is None:
+        with _cipher_lock:
+            cipher = VersionedMultiFernet(get_keyring())
+            mtime = os.stat(KEYRING_FILE).st_mtime_ns
+            _cipher_cache.clear()
+            _cipher_cache[(os.path.abspath(KEYRING_FILE), mtime)] = cipher
+    return cipher
+
+def rotate_key():
+    """Add a new primary key; older keys stay for decryption until records are re-encrypted"""
+    with _cipher_lock:
+        keyring = get_keyring()
+        version = keyring[0][0] + 1
+        _write_keyring([(version, Fernet.generate_key())] + keyring)
+        _cipher_cache.clear()
+    return version
+
+def retire_old_keys():
+    """Drop every key but the primary (only after all records are re-encrypted)"""
+    with _cipher_lock:
+        keyring = get_keyring()
+        _write_keyring(keyring[:1])
+        _cipher_cache.clear()
+    return len(keyring) - 1
 
 def mask_name(patient_id):
     """Generate anonymized name (GDPR data minimization)"""
@@ -38,3 +116,70 @@ def decrypt_field(cipher, encrypted_value):
         return ""
     except Exception as e:
         return f"[Decryption Error: {e}]"
+
+
+class DecryptedValueCache:
+    """Small TTL + LRU cache of decrypted values for one admin session, wiped on logout
+
+    Keys are the ciphertexts themselves, so a re-encrypted or updated
+    record never returns a stale plaintext.
+    """
+
+    def __init__(self, max_entries=DECRYPT_CACHE_SIZE, ttl=DECRYPT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # ciphertext -> (expires_at, plaintext)
+        self._lock = threading.Lock()
+
+    def get(self, ciphertext):
+        with self._lock:
+            entry = self._entries.get(ciphertext)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[ciphertext]
+                return None
+            self._entries.move_to_end(ciphertext)
+            return entry[1]
+
+    def put(self, ciphertext, plaintext):
+        with self._lock:
+            self._entries[ciphertext] = (time.monotonic() + self.ttl, plaintext)
+            self._entries.move_to_end(ciphertext)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def wipe(self):
+        """Drop every decrypted value (logout)"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+def decrypt_fields(cipher, encrypted_values, cache=None):
+    """Decrypt many Fernet values at once on the worker pool (Admin only, logged action)
+
+    Returns plaintexts in input order; values found in cache are not
+    decrypted again and new results are added to it.
+    """
+    results = [None] * len(encrypted_values)
+    todo = []
+    for i, value in enumerate(encrypted_values):
+        cached = cache.get(value) if cache is not None and value else None
+        if cached is not None:
+            results[i] = cached
+        else:
+            todo.append(i)
+    
+    if len(todo) < DECRYPT_BATCH_INLINE:
+        plaintexts = [decrypt_field(cipher, encrypted_values[i]) for i in todo]
+    else:
+        plaintexts = list(_decrypt_pool.map(lambda i: decrypt_field(cipher, encrypted_values[i]), todo))
+    
+    for i, plaintext in zip(todo, plaintexts):
+        results[i] = plaintext
+        # Never cache errors or empty values
+        if cache is not None and encrypted_values[i] and not plaintext.startswith("[Decryption Error"):
+            cache.put(encrypted_values[i], plaintext)
+    return results
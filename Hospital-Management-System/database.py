@@ -1,22 +1,173 @@
+import base64
+import csv
+import hashlib
+import io
+import json
+import os
 import sqlite3
+import threading
+import time
 import bcrypt
-from datetime import datetime
+import pandas as pd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from datetime import datetime, timedelta
 from contextlib import contextmanager
+from functools import wraps
+from cache_utils import read_cache, bump_generation, bump_all_generations
+from crypto_utils import mask_name, mask_contact
+from perf_utils import InstrumentedConnection
 
 DATABASE = "hospital.db"
 
+# PRAGMA profiles for pooled connections (negative cache_size is KiB)
+DB_PROFILES = {
+    "balanced": {"cache_size": -16000, "mmap_size": 64 * 1024 * 1024, "busy_timeout": 5000},
+    "read_heavy": {"cache_size": -64000, "mmap_size": 256 * 1024 * 1024, "busy_timeout": 5000},
+    "low_memory": {"cache_size": -2000, "mmap_size": 0, "busy_timeout": 10000},
+}
+DB_PROFILE = "balanced"
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+_pool_lock = threading.Lock()
+_pool = {}  # (thread id, database path) -> connection, for shutdown
+_pool_generation = 0  # bumped by close_all_connections so threads drop stale handles
+_watch_lock = threading.Lock()
+_watchers = {}  # database path -> process-wide PRAGMA data_version watcher (see _sync_data_version)
+
+
+def current_database():
+    """Database file this thread is working on (see use_database), else DATABASE"""
+    return getattr(_local, "database", None) or DATABASE
+
+
 @contextmanager
-def get_db_connection():
-    """Context manager for database connections with foreign keys enabled"""
-    conn = sqlite3.connect(DATABASE, check_same_thread=False)
+def use_database(path):
+    """Route this thread's database calls to another SQLite file (e.g. a shard)"""
+    previous = getattr(_local, "database", None)
+    _local.database = path
+    try:
+        yield path
+    finally:
+        _local.database = previous
+
+
+def set_db_profile(profile):
+    """Select the PRAGMA profile applied to pooled connections (Availability)"""
+    global DB_PROFILE
+    if profile not in DB_PROFILES:
+        raise ValueError(f"Unknown database profile: {profile}")
+    DB_PROFILE = profile
+    close_all_connections()
+
+
+class PooledConnection(InstrumentedConnection):
+    """Pooled connection whose commits move the process-wide data_version baseline"""
+
+    def commit(self):
+        if not self.in_transaction:
+            return super().commit()
+        watcher = _watcher(self.path)
+        with watcher['lock']:
+            # Anything that landed before this commit came from another process
+            if _poll_data_version(watcher):
+                bump_all_generations()
+            super().commit()
+            _poll_data_version(watcher)
+
+
+def _open_connection(path):
+    """Open and tune a new connection for the pool"""
+    # InstrumentedConnection records per-statement latency and row counts (perf_utils)
+    conn = sqlite3.connect(path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE,
+                           factory=PooledConnection)
+    conn.path = path
     # Enable foreign key constraints per connection as required by SQLite
     conn.execute("PRAGMA foreign_keys = ON;")
+    # WAL lets readers proceed while a writer commits
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    for pragma, value in DB_PROFILES[DB_PROFILE].items():
+        conn.execute(f"PRAGMA {pragma} = {int(value)};")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _prune_dead_threads():
+    """Close connections owned by threads that have exited (Streamlit reruns spawn new threads)"""
+    alive = {t.ident for t in threading.enumerate()}
+    with _pool_lock:
+        dead = [key for key in _pool if key[0] not in alive]
+        stale = [_pool.pop(key) for key in dead]
+    for conn in stale:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+def _thread_pool():
+    """Return the calling thread's connection map and nesting depths"""
+    if getattr(_local, "generation", None) != _pool_generation:
+        _local.connections = {}
+        _local.depth = {}
+        _local.generation = _pool_generation
+    return _local.connections, _local.depth
+
+
+@contextmanager
+def get_db_connection():
+    """Context manager yielding this thread's pooled connection with foreign keys enabled"""
+    path = current_database()
+    connections, depth = _thread_pool()
+    conn = connections.get(path)
+    if conn is None:
+        _prune_dead_threads()
+        conn = _open_connection(path)
+        connections[path] = conn
+        depth[path] = 0
+        with _pool_lock:
+            _pool[(threading.get_ident(), path)] = conn
+    depth[path] += 1
+    try:
+        yield conn
+    finally:
+        depth[path] -= 1
+        # Uncommitted work is discarded, as it was when each call closed its connection
+        if depth[path] == 0 and conn.in_transaction:
+            conn.rollback()
+
+
+@contextmanager
+def get_read_connection(path=None):
+    """Dedicated read-only connection for long streaming reads (exports) outside the pool"""
+    conn = sqlite3.connect(f"file:{path or current_database()}?mode=ro", uri=True, check_same_thread=False,
+                           factory=InstrumentedConnection)
     conn.row_factory = sqlite3.Row
     try:
         yield conn
     finally:
         conn.close()
 
+
+def close_all_connections():
+    """Close every pooled connection (shutdown, profile change or tests)"""
+    global _pool_generation
+    with _pool_lock:
+        connections = list(_pool.values())
+        _pool.clear()
+        _pool_generation += 1
+    with _watch_lock:
+        connections += [watcher['conn'] for watcher in _watchers.values()]
+        _watchers.clear()
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
 def init_database():
     """Initialize database schema and seed default users"""
     with get_db_connection() as conn:
@@ -33,19 +184,7 @@ def init_database():
         """)
         
         # Create patients table with anonymization fields for confidentiality
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS patients (
-                patient_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                contact TEXT NOT NULL,
-                diagnosis TEXT NOT NULL,
-                anonymized_name TEXT,
-                anonymized_contact TEXT,
-                encrypted_name TEXT,
-                encrypted_contact TEXT,
-                date_added TEXT NOT NULL
-            )
-        """)
+        _create_patients_table(cursor)
         
         # Create logs table with foreign key for integrity and accountability
         cursor.execute("""
@@ -68,6 +207,9 @@ def init_database():
         ]
         
         for username, password, role in default_users:
+            # Skip the bcrypt cost when the user is already seeded
+            if cursor.execute("SELECT 1 FROM users WHERE username=?", (username,)).fetchone():
+                continue
             try:
                 pwd_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
                 cursor.execute(
@@ -78,19 +220,430 @@ def init_database():
                 pass  # User already exists
         
         conn.commit()
+        run_migrations(conn)
         print("✅ Database initialized with foreign key constraints enabled")
 
+def _create_patients_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS patients (
+            patient_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            contact TEXT NOT NULL,
+            diagnosis TEXT NOT NULL,
+            anonymized_name TEXT,
+            anonymized_contact TEXT,
+            encrypted_name TEXT,
+            encrypted_contact TEXT,
+            date_added TEXT NOT NULL
+        )
+    """)
+
+def init_shard_database():
+    """Initialize a patient shard: patients plus its indexes, rollup, search index and change feed
+
+    Users, sessions, settings and the audit log live only in the main
+    database, so shards get none of them (and no seeded users).
+    """
+    with get_db_connection() as conn:
+        _create_patients_table(conn.cursor())
+        conn.commit()
+        run_migrations(conn, SHARD_MIGRATIONS)
+
+# ========== SCHEMA MIGRATIONS ==========
+# Each entry upgrades the schema by one PRAGMA user_version step. Migrations
+# only ever add objects, so upgrading an existing hospital.db never rebuilds
+# a table. Append new migrations; never edit or reorder released ones.
+
+def _migration_logs_indexes(cursor):
+    """Index the audit log hot paths (ordering, user join, action/role filters)"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs(timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_logs_user_id ON logs(user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_logs_action_role_timestamp ON logs(action, role, timestamp)")
+
+def _migration_patients_indexes(cursor):
+    """Index patients for date_added ordering and keyset pagination"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_patients_date_added ON patients(date_added)")
+
+def _migration_anonymization_runs(cursor):
+    """Checkpoint table so an interrupted anonymization run can resume"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS anonymization_runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            last_patient_id INTEGER NOT NULL DEFAULT 0,
+            rows_done INTEGER NOT NULL DEFAULT 0,
+            started_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            completed_at TEXT
+        )
+    """)
+
+def _migration_patients_change_tracking(cursor):
+    """Row versioning so anonymization only processes new or changed patients"""
+    cursor.execute("ALTER TABLE patients ADD COLUMN last_updated TEXT")
+    cursor.execute("ALTER TABLE patients ADD COLUMN row_version INTEGER NOT NULL DEFAULT 1")
+    cursor.execute("ALTER TABLE patients ADD COLUMN anonymized_version INTEGER")
+    cursor.execute("UPDATE patients SET last_updated = date_added")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_patients_dirty ON patients(patient_id) "
+        "WHERE anonymized_version IS NOT row_version"
+    )
+
+def _migration_diagnosis_rollup(cursor):
+    """Patients-per-diagnosis counts kept current by triggers"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS diagnosis_counts (
+            diagnosis TEXT PRIMARY KEY,
+            patient_count INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_patients_diagnosis_insert AFTER INSERT ON patients
+        BEGIN
+            INSERT INTO diagnosis_counts (diagnosis, patient_count) VALUES (NEW.diagnosis, 1)
+            ON CONFLICT(diagnosis) DO UPDATE SET patient_count = patient_count + 1;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_patients_diagnosis_update AFTER UPDATE OF diagnosis ON patients
+        WHEN OLD.diagnosis IS NOT NEW.diagnosis
+        BEGIN
+            UPDATE diagnosis_counts SET patient_count = patient_count - 1 WHERE diagnosis = OLD.diagnosis;
+            DELETE FROM diagnosis_counts WHERE diagnosis = OLD.diagnosis AND patient_count <= 0;
+            INSERT INTO diagnosis_counts (diagnosis, patient_count) VALUES (NEW.diagnosis, 1)
+            ON CONFLICT(diagnosis) DO UPDATE SET patient_count = patient_count + 1;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_patients_diagnosis_delete AFTER DELETE ON patients
+        BEGIN
+            UPDATE diagnosis_counts SET patient_count = patient_count - 1 WHERE diagnosis = OLD.diagnosis;
+            DELETE FROM diagnosis_counts WHERE diagnosis = OLD.diagnosis AND patient_count <= 0;
+        END
+    """)
+    # Backfill from existing rows once
+    cursor.execute("""
+        INSERT OR REPLACE INTO diagnosis_counts (diagnosis, patient_count)
+        SELECT diagnosis, COUNT(*) FROM patients GROUP BY diagnosis
+    """)
+
+def _migration_rollups(cursor):
+    """Rollup tables kept current by triggers so dashboards never scan patients or logs"""
+    _migration_diagnosis_rollup(cursor)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS log_daily_counts (
+            day TEXT NOT NULL,
+            role TEXT NOT NULL,
+            action TEXT NOT NULL,
+            log_count INTEGER NOT NULL,
+            PRIMARY KEY (day, role, action)
+        )
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_logs_daily_insert AFTER INSERT ON logs
+        BEGIN
+            INSERT INTO log_daily_counts (day, role, action, log_count)
+            VALUES (substr(NEW.timestamp, 1, 10), NEW.role, NEW.action, 1)
+            ON CONFLICT(day, role, action) DO UPDATE SET log_count = log_count + 1;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_logs_daily_delete AFTER DELETE ON logs
+        BEGIN
+            UPDATE log_daily_counts SET log_count = log_count - 1
+            WHERE day = substr(OLD.timestamp, 1, 10) AND role = OLD.role AND action = OLD.action;
+        END
+    """)
+    # Backfill from existing rows once
+    cursor.execute("""
+        INSERT OR REPLACE INTO log_daily_counts (day, role, action, log_count)
+        SELECT substr(timestamp, 1, 10), role, action, COUNT(*) FROM logs
+        GROUP BY substr(timestamp, 1, 10), role, action
+    """)
+
+def _migration_sessions(cursor):
+    """Server-side session store keyed by a hash of the opaque session token"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            token_hash TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions(expires_at)")
+
+def _migration_patients_key_version(cursor):
+    """Record which Fernet key version encrypted each patient's fields"""
+    cursor.execute("ALTER TABLE patients ADD COLUMN key_version INTEGER")
+
+def _migration_settings(cursor):
+    """Key/value application settings (data retention and similar)"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    """)
+
+def _migration_patients_fts(cursor):
+    """FTS5 index over diagnosis and anonymized identifiers only (never raw name/contact)"""
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+            diagnosis, anonymized_name, anonymized_contact,
+            content='patients', content_rowid='patient_id'
+        )
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_patients_fts_insert AFTER INSERT ON patients
+        BEGIN
+            INSERT INTO patients_fts (rowid, diagnosis, anonymized_name, anonymized_contact)
+            VALUES (NEW.patient_id, NEW.diagnosis, NEW.anonymized_name, NEW.anonymized_contact);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_patients_fts_delete AFTER DELETE ON patients
+        BEGIN
+            INSERT INTO patients_fts (patients_fts, rowid, diagnosis, anonymized_name, anonymized_contact)
+            VALUES ('delete', OLD.patient_id, OLD.diagnosis, OLD.anonymized_name, OLD.anonymized_contact);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_patients_fts_update
+        AFTER UPDATE OF diagnosis, anonymized_name, anonymized_contact ON patients
+        BEGIN
+            INSERT INTO patients_fts (patients_fts, rowid, diagnosis, anonymized_name, anonymized_contact)
+            VALUES ('delete', OLD.patient_id, OLD.diagnosis, OLD.anonymized_name, OLD.anonymized_contact);
+            INSERT INTO patients_fts (rowid, diagnosis, anonymized_name, anonymized_contact)
+            VALUES (NEW.patient_id, NEW.diagnosis, NEW.anonymized_name, NEW.anonymized_contact);
+        END
+    """)
+    cursor.execute("INSERT INTO patients_fts (patients_fts) VALUES ('rebuild')")
+
+LOG_CHAIN_GENESIS = "0" * 64
+LOG_CHAIN_BATCH = 10000
+
+def compute_log_hash(prev_hash, user_id, role, action, timestamp, details):
+    """SHA-256 of an audit entry chained to the previous entry's hash (tamper evidence)"""
+    # Fields are hashed as text, the way SQLite hands them back on verification
+    payload = json.dumps([prev_hash, str(user_id), role, action, timestamp,
+                          "" if details is None else str(details)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _migration_logs_hash_chain(cursor):
+    """Chain every log entry to its predecessor and keep signed verification checkpoints"""
+    cursor.execute("ALTER TABLE logs ADD COLUMN prev_hash TEXT")
+    cursor.execute("ALTER TABLE logs ADD COLUMN entry_hash TEXT")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS log_checkpoints (
+            checkpoint_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            last_log_id INTEGER NOT NULL,
+            last_hash TEXT NOT NULL,
+            rows_verified INTEGER NOT NULL,
+            status TEXT NOT NULL CHECK (status IN ('ok', 'broken')),
+            broken_log_id INTEGER,
+            checked_at TEXT NOT NULL,
+            signature TEXT NOT NULL
+        )
+    """)
+    # Backfill existing entries in log_id order, one batch at a time
+    prev_hash, last_id = LOG_CHAIN_GENESIS, 0
+    while True:
+        rows = cursor.execute("""
+            SELECT log_id, user_id, role, action, timestamp, details FROM logs
+            WHERE log_id > ? ORDER BY log_id LIMIT ?
+        """, (last_id, LOG_CHAIN_BATCH)).fetchall()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            entry_hash = compute_log_hash(prev_hash, *tuple(row)[1:])
+            updates.append((prev_hash, entry_hash, row[0]))
+            prev_hash = entry_hash
+        cursor.executemany("UPDATE logs SET prev_hash = ?, entry_hash = ? WHERE log_id = ?", updates)
+        last_id = rows[-1][0]
+
+RATE_COUNTER_MINUTES = 24 * 60  # per-minute counters kept for rate alerts
+
+def _migration_log_minute_counts(cursor):
+    """Per-minute action counters for rate alerts (login bursts and similar)"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS log_minute_counts (
+            minute TEXT NOT NULL,
+            action TEXT NOT NULL,
+            log_count INTEGER NOT NULL,
+            PRIMARY KEY (minute, action)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_logs_minute_insert AFTER INSERT ON logs
+        BEGIN
+            INSERT INTO log_minute_counts (minute, action, log_count)
+            VALUES (substr(NEW.timestamp, 1, 16), NEW.action, 1)
+            ON CONFLICT(minute, action) DO UPDATE SET log_count = log_count + 1;
+        END
+    """)
+    since = (datetime.now() - timedelta(minutes=RATE_COUNTER_MINUTES)).strftime("%Y-%m-%d %H:%M")
+    cursor.execute("""
+        INSERT OR REPLACE INTO log_minute_counts (minute, action, log_count)
+        SELECT substr(timestamp, 1, 16), action, COUNT(*) FROM logs
+        WHERE timestamp >= ?
+        GROUP BY substr(timestamp, 1, 16), action
+    """, (since,))
+
+def _migration_change_feed(cursor):
+    """Append-only feed of changed row ids so open sessions can apply deltas"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            op TEXT NOT NULL CHECK (op IN ('insert', 'update', 'delete')),
+            changed_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_changes_table_seq ON changes(table_name, seq)")
+    for event, op, ref in (("INSERT", "insert", "NEW"), ("UPDATE", "update", "NEW"), ("DELETE", "delete", "OLD")):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_patients_changes_{op} AFTER {event} ON patients
+            BEGIN
+                INSERT INTO changes (table_name, row_id, op) VALUES ('patients', {ref}.patient_id, '{op}');
+            END
+        """)
+
+MIGRATIONS = [
+    _migration_logs_indexes,
+    _migration_patients_indexes,
+    _migration_anonymization_runs,
+    _migration_patients_change_tracking,
+    _migration_rollups,
+    _migration_sessions,
+    _migration_patients_key_version,
+    _migration_settings,
+    _migration_patients_fts,
+    _migration_logs_hash_chain,
+    _migration_log_minute_counts,
+    _migration_change_feed,
+]
+
+# Patient shards only carry the patients side of the schema; versioned separately
+SHARD_MIGRATIONS = [
+    _migration_patients_indexes,
+    _migration_anonymization_runs,
+    _migration_patients_change_tracking,
+    _migration_diagnosis_rollup,
+    _migration_patients_key_version,
+    _migration_patients_fts,
+    _migration_change_feed,
+]
+
+def get_schema_version(conn):
+    """Return the schema version recorded in PRAGMA user_version"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def run_migrations(conn, migrations=MIGRATIONS):
+    """Apply pending migrations, one transaction per version (Integrity)"""
+    # Up-to-date schemas (every rerun) are checked without taking the write lock
+    version = get_schema_version(conn)
+    if version >= len(migrations):
+        return version
+    while True:
+        # IMMEDIATE takes the write lock so concurrent starters cannot double-apply
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = get_schema_version(conn)
+            if version >= len(migrations):
+                conn.rollback()
+                return version
+            migrations[version](conn.cursor())
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+# ========== READ CACHE ==========
+
+def _watcher(path):
+    """Process-wide connection used only to read PRAGMA data_version for a database file"""
+    with _watch_lock:
+        watcher = _watchers.get(path)
+        if watcher is None:
+            conn = sqlite3.connect(path, check_same_thread=False)
+            watcher = _watchers[path] = {'conn': conn, 'lock': threading.Lock(),
+                                         'version': conn.execute("PRAGMA data_version").fetchone()[0]}
+        return watcher
+
+def _poll_data_version(watcher):
+    """True if the file changed since the watcher last looked (caller holds watcher['lock'])"""
+    version = watcher['conn'].execute("PRAGMA data_version").fetchone()[0]
+    changed = version != watcher['version']
+    watcher['version'] = version
+    return changed
+
+def _sync_data_version():
+    """Invalidate the read cache when another process has committed
+
+    One watcher per database file holds the baseline for the whole process,
+    so a fresh thread still notices foreign writes. Pooled commits move the
+    baseline themselves (PooledConnection) and are never mistaken for
+    foreign ones; CACHE_TTL covers a foreign commit racing our own.
+    """
+    watcher = _watcher(current_database())
+    with watcher['lock']:
+        if _poll_data_version(watcher):
+            bump_all_generations()
+
+def cached_read(*tables):
+    """Serve a read function from the shared cache until one of its tables is written"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            _sync_data_version()
+            key = (current_database(), func.__name__) + args + tuple(sorted(kwargs.items()))
+            return read_cache.get_or_load(key, tables, lambda: func(*args, **kwargs))
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
 def add_log(user_id, role, action, details=""):
     """Add audit log entry for accountability (GDPR Article 5)"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    add_logs([(user_id, role, action, timestamp, details)])
+
+def _log_chain_head(conn):
+    """Hash the next log entry chains to: the newest entry, else the last verified checkpoint"""
+    row = conn.execute("SELECT entry_hash FROM logs ORDER BY log_id DESC LIMIT 1").fetchone()
+    if row is None:
+        # Every entry was archived; continue from where verification left off
+        row = conn.execute("""
+            SELECT last_hash FROM log_checkpoints WHERE status = 'ok'
+            ORDER BY checkpoint_id DESC LIMIT 1
+        """).fetchone()
+    return row[0] if row and row[0] else LOG_CHAIN_GENESIS
+
+def add_logs(entries):
+    """Insert a batch of (user_id, role, action, timestamp, details) log entries in one transaction
+
+    Each entry stores the previous entry's hash and its own; IMMEDIATE keeps
+    the read of the chain head and the inserts atomic across processes.
+    """
     with get_db_connection() as conn:
-        cursor = conn.cursor()
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute(
-            "INSERT INTO logs (user_id, role, action, timestamp, details) VALUES (?, ?, ?, ?, ?)",
-            (user_id, role, action, timestamp, details)
-        )
+        conn.execute("BEGIN IMMEDIATE")
+        prev_hash = _log_chain_head(conn)
+        rows = []
+        for user_id, role, action, timestamp, details in entries:
+            entry_hash = compute_log_hash(prev_hash, user_id, role, action, timestamp, details)
+            rows.append((user_id, role, action, timestamp, details, prev_hash, entry_hash))
+            prev_hash = entry_hash
+        conn.executemany("""
+            INSERT INTO logs (user_id, role, action, timestamp, details, prev_hash, entry_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, rows)
         conn.commit()
+    bump_generation("logs")
 
+@cached_read("patients")
 def get_all_patients():
     """Retrieve all patients for availability"""
     with get_db_connection() as conn:
@@ -98,6 +651,229 @@ def get_all_patients():
         cursor.execute("SELECT * FROM patients ORDER BY date_added DESC")
         return cursor.fetchall()
 
+@cached_read("patients")
+def get_patient_count():
+    """Exact number of patients (COUNT(*) on the primary key, no row transfer)"""
+    with get_db_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0]
+
+# ========== COLUMNAR FETCH ==========
+
+FRAME_CHUNK_SIZE = 10000
+# Typed columns for DataFrames built by fetch_frame/frame_from_rows; text columns use pandas' default
+FRAME_DTYPES = {
+    'patient_id': 'int64', 'log_id': 'int64', 'user_id': 'int64',
+    'row_version': 'Int64', 'anonymized_version': 'Int64', 'key_version': 'Int64',
+    'log_count': 'int64', 'patient_count': 'int64',
+    'role': 'category', 'action': 'category', 'diagnosis': 'category',
+}
+FRAME_DATETIMES = {'date_added', 'last_updated', 'timestamp', 'day'}
+PATIENT_COLUMNS = ('patient_id', 'name', 'contact', 'diagnosis', 'anonymized_name',
+                   'anonymized_contact', 'encrypted_name', 'encrypted_contact',
+                   'date_added', 'last_updated', 'row_version', 'anonymized_version', 'key_version')
+
+def _build_frame(names, columns):
+    """Assemble column lists into a DataFrame with FRAME_DTYPES applied"""
+    data = {}
+    for name, values in zip(names, columns):
+        values = list(values)
+        if name in FRAME_DATETIMES:
+            data[name] = pd.to_datetime(values, format='ISO8601', errors='coerce')
+        else:
+            data[name] = pd.Series(values, dtype=FRAME_DTYPES.get(name))
+    return pd.DataFrame(data, columns=list(names))
+
+def fetch_frame(query, params=(), chunk_size=FRAME_CHUNK_SIZE):
+    """Run a query and build a typed DataFrame straight from the cursor
+
+    Rows are fetched as plain tuples in chunks and appended to per-column
+    lists, so no sqlite3.Row or per-row dict is ever materialized.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(query, params)
+        names = [d[0] for d in cursor.description]
+        columns = [[] for _ in names]
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for column, values in zip(columns, zip(*rows)):
+                column.extend(values)
+    return _build_frame(names, columns)
+
+def frame_from_rows(rows):
+    """Typed DataFrame from already fetched sqlite3.Row objects or dicts (e.g. a keyset page)"""
+    if not rows:
+        return pd.DataFrame()
+    names = list(rows[0].keys())
+    if isinstance(rows[0], dict):
+        rows = [tuple(row.values()) for row in rows]
+    return _build_frame(names, zip(*rows))
+
+def apply_frame_changes(frame, changed, removed_ids, key, sort_by=None):
+    """Apply a delta to a DataFrame: drop removed/changed keys, add the changed rows
+
+    Only the changed rows come from the database; the rest of the frame is
+    reused. Categorical columns are re-categorized if new values widened them.
+    """
+    drop = frame[key].isin(list(removed_ids) + changed[key].tolist())
+    merged = pd.concat([changed, frame[~drop]], ignore_index=True)
+    for name, dtype in FRAME_DTYPES.items():
+        if dtype == 'category' and name in merged.columns and merged[name].dtype != 'category':
+            merged[name] = merged[name].astype('category')
+    if sort_by and len(changed):
+        merged = merged.sort_values(sort_by, ascending=False, kind='stable', ignore_index=True)
+    return merged
+
+@cached_read("patients")
+def get_patients_frame(columns=None):
+    """All patients as a typed DataFrame, newest first, optionally only a tuple of columns"""
+    columns = columns or PATIENT_COLUMNS
+    unknown = set(columns) - set(PATIENT_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown patient columns: {sorted(unknown)}")
+    return fetch_frame(f"SELECT {', '.join(columns)} FROM patients ORDER BY date_added DESC")
+
+def get_patients_frame_by_ids(ids, columns=None):
+    """Typed DataFrame of just the given patients (used to apply change-feed deltas)"""
+    columns = columns or PATIENT_COLUMNS
+    if set(columns) - set(PATIENT_COLUMNS):
+        raise ValueError(f"Unknown patient columns: {sorted(set(columns) - set(PATIENT_COLUMNS))}")
+    ids = list(ids)
+    frames = []
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        frames.append(fetch_frame(f"""
+            SELECT {', '.join(columns)} FROM patients
+            WHERE patient_id IN ({', '.join('?' * len(chunk))})
+        """, chunk))
+    if not frames:
+        return fetch_frame(f"SELECT {', '.join(columns)} FROM patients WHERE 0")
+    return pd.concat(frames, ignore_index=True)
+
+def get_patients_snapshot(columns=None):
+    """Uncached patients frame and the change sequence number it reflects
+
+    Both are read in one transaction, so applying the changes after seq
+    later neither misses nor skips a write committed during the load.
+    """
+    with get_db_connection() as conn:
+        conn.execute("BEGIN")
+        try:
+            seq = get_change_seq()
+            frame = get_patients_frame.uncached(columns)
+        finally:
+            conn.rollback()
+    return seq, frame
+
+# ========== CHANGE FEED ==========
+
+CHANGE_FEED_LIMIT = 10000  # larger deltas are cheaper to apply as a full reload
+CHANGE_FEED_RETENTION_DAYS = 7
+
+def get_change_seq():
+    """Latest change sequence number (O(1) via sqlite_sequence)"""
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+        return row[0] if row else 0
+
+def get_changes_since(seq, table, limit=CHANGE_FEED_LIMIT):
+    """Rows of a table changed after seq, collapsed to their latest operation
+
+    Returns {'seq', 'upserts', 'deletes', 'reset'}; reset means the caller
+    is too far behind (delta over limit or already pruned) and should reload.
+    """
+    latest = get_change_seq()
+    result = {'seq': latest, 'upserts': [], 'deletes': [], 'reset': False}
+    if latest <= seq:
+        return result
+    with get_db_connection() as conn:
+        oldest = conn.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+        if oldest is None or oldest > seq + 1:
+            result['reset'] = True
+            return result
+        rows = conn.execute("""
+            SELECT row_id, op FROM changes
+            WHERE table_name = ? AND seq > ? AND seq <= ?
+            ORDER BY seq LIMIT ?
+        """, (table, seq, latest, limit + 1)).fetchall()
+    if len(rows) > limit:
+        result['reset'] = True
+        return result
+    final = {}
+    for row_id, op in rows:
+        final[row_id] = op
+    result['upserts'] = [row_id for row_id, op in final.items() if op != 'delete']
+    result['deletes'] = [row_id for row_id, op in final.items() if op == 'delete']
+    return result
+
+def count_changes_since(seq, table):
+    """Number of change feed entries for a table after seq (index range count)"""
+    with get_db_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM changes WHERE table_name = ? AND seq > ?",
+                            (table, seq)).fetchone()[0]
+
+def prune_changes(max_age_days=CHANGE_FEED_RETENTION_DAYS):
+    """Drop change feed entries older than max_age_days; sessions that far behind reload"""
+    with get_db_connection() as conn:
+        cursor = conn.execute("DELETE FROM changes WHERE changed_at < datetime('now', ?)",
+                              (f"-{int(max_age_days)} days",))
+        conn.commit()
+        return cursor.rowcount
+
+def encode_page_token(sort_value, row_id):
+    """Encode a keyset position (sort column value, row id) as an opaque page token"""
+    raw = f"{sort_value}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_page_token(token):
+    """Decode a page token back into (sort_value, row_id)"""
+    try:
+        sort_value, row_id = base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8").rsplit("|", 1)
+        return sort_value, int(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid page token: {token}") from e
+
+@cached_read("patients")
+def get_patient_count_estimate():
+    """Approximate patient count from the AUTOINCREMENT sequence (O(1), ignores deletions)"""
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'patients'").fetchone()
+        return row['seq'] if row else 0
+
+@cached_read("patients")
+def get_patients_page(page_token=None, page_size=25):
+    """Keyset-paginated patients, newest first (Availability at scale)
+
+    Returns a dict with the page ``rows``, the ``next_token`` for the following
+    page (None on the last page) and an approximate ``total``.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if page_token:
+            date_added, patient_id = decode_page_token(page_token)
+            cursor.execute("""
+                SELECT * FROM patients
+                WHERE (date_added, patient_id) < (?, ?)
+                ORDER BY date_added DESC, patient_id DESC
+                LIMIT ?
+            """, (date_added, patient_id, page_size + 1))
+        else:
+            cursor.execute("""
+                SELECT * FROM patients
+                ORDER BY date_added DESC, patient_id DESC
+                LIMIT ?
+            """, (page_size + 1,))
+        rows = cursor.fetchall()
+    next_token = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_token = encode_page_token(rows[-1]['date_added'], rows[-1]['patient_id'])
+    return {'rows': rows, 'next_token': next_token, 'total': get_patient_count_estimate()}
+
+@cached_read("logs")
 def get_all_logs():
     """Retrieve audit logs for integrity verification (Admin only)"""
     with get_db_connection() as conn:
@@ -111,51 +887,703 @@ def get_all_logs():
         """)
         return cursor.fetchall()
 
-def add_patient(name, contact, diagnosis, anon_name, anon_contact, enc_name="", enc_contact=""):
+def build_log_filters(action=None, role=None, user_id=None, start=None, end=None, page_token=None):
+    """WHERE clause and parameters for log filters on table alias l (shared with the archive)"""
+    conditions = []
+    params = []
+    if action:
+        conditions.append("l.action = ?")
+        params.append(action)
+    if role:
+        conditions.append("l.role = ?")
+        params.append(role)
+    if user_id is not None:
+        conditions.append("l.user_id = ?")
+        params.append(user_id)
+    if start:
+        conditions.append("l.timestamp >= ?")
+        params.append(start)
+    if end:
+        conditions.append("l.timestamp < ?")
+        params.append(end)
+    if page_token:
+        conditions.append("(l.timestamp, l.log_id) < (?, ?)")
+        params.extend(decode_page_token(page_token))
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    return where, params
+
+@cached_read("logs")
+def get_logs_page(action=None, role=None, user_id=None, start=None, end=None,
+                  page_token=None, page_size=100):
+    """Filtered, keyset-paginated audit logs, newest first (Admin only)
+
+    start/end are "YYYY-MM-DD HH:MM:SS" strings; start is inclusive and end
+    exclusive. Returns a dict with ``rows`` and ``next_token``.
+    """
+    where, params = build_log_filters(action, role, user_id, start, end, page_token)
+    with get_db_connection() as conn:
+        rows = conn.execute(f"""
+            SELECT l.log_id, l.user_id, u.username, l.role, l.action, 
+                   l.timestamp, l.details
+            FROM logs l
+            LEFT JOIN users u ON l.user_id = u.user_id
+            {where}
+            ORDER BY l.timestamp DESC, l.log_id DESC
+            LIMIT ?
+        """, params + [page_size + 1]).fetchall()
+    next_token = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_token = encode_page_token(rows[-1]['timestamp'], rows[-1]['log_id'])
+    return {'rows': rows, 'next_token': next_token}
+
+@cached_read("logs")
+def get_log_actions():
+    """Distinct logged actions, from the rollup table rather than a logs scan"""
+    with get_db_connection() as conn:
+        return [row[0] for row in conn.execute(
+            "SELECT DISTINCT action FROM log_daily_counts WHERE log_count > 0 ORDER BY action"
+        )]
+
+@cached_read("logs")
+def get_log_roles():
+    """Distinct logged roles, from the rollup table rather than a logs scan"""
+    with get_db_connection() as conn:
+        return [row[0] for row in conn.execute(
+            "SELECT DISTINCT role FROM log_daily_counts WHERE log_count > 0 ORDER BY role"
+        )]
+
+@cached_read("logs")
+def get_log_user_count():
+    """Number of users with at least one log entry (one index probe per user)"""
+    with get_db_connection() as conn:
+        return conn.execute("""
+            SELECT COUNT(*) FROM users u
+            WHERE EXISTS (SELECT 1 FROM logs l WHERE l.user_id = u.user_id)
+        """).fetchone()[0]
+
+# ========== SETTINGS ==========
+
+def get_setting(key, default=None):
+    """Read an application setting (stored as text)"""
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else default
+
+def set_setting(key, value):
+    """Create or update an application setting"""
+    with get_db_connection() as conn:
+        conn.execute("""
+            INSERT INTO settings (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (key, str(value)))
+        conn.commit()
+
+# ========== SESSIONS ==========
+# Times are epoch seconds so expiry checks are integer comparisons on an index.
+
+def create_session_record(token_hash, user_id, created_at, expires_at):
+    """Persist a new session"""
+    with get_db_connection() as conn:
+        conn.execute(
+            "INSERT INTO sessions (token_hash, user_id, created_at, expires_at) VALUES (?, ?, ?, ?)",
+            (token_hash, user_id, created_at, expires_at)
+        )
+        conn.commit()
+
+def get_session_record(token_hash, now):
+    """Return the unexpired session joined with its user, or None"""
+    with get_db_connection() as conn:
+        return conn.execute("""
+            SELECT s.token_hash, s.expires_at, u.user_id, u.username, u.role
+            FROM sessions s JOIN users u ON s.user_id = u.user_id
+            WHERE s.token_hash = ? AND s.expires_at > ?
+        """, (token_hash, now)).fetchone()
+
+def extend_session_record(token_hash, expires_at):
+    """Slide a session's expiry forward"""
+    with get_db_connection() as conn:
+        conn.execute("UPDATE sessions SET expires_at = ? WHERE token_hash = ?", (expires_at, token_hash))
+        conn.commit()
+
+def delete_session_record(token_hash):
+    """Revoke a session (logout)"""
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM sessions WHERE token_hash = ?", (token_hash,))
+        conn.commit()
+
+def sweep_expired_sessions(now, batch_size=500):
+    """Delete expired sessions in small batches so no sweep holds the write lock for long"""
+    removed = 0
+    while True:
+        with get_db_connection() as conn:
+            cursor = conn.execute("""
+                DELETE FROM sessions WHERE token_hash IN (
+                    SELECT token_hash FROM sessions WHERE expires_at <= ? LIMIT ?
+                )
+            """, (now, batch_size))
+            conn.commit()
+        removed += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return removed
+
+# ========== SEARCH ==========
+# Only the newest matches are ranked so broad terms stay fast on large tables
+SEARCH_CANDIDATES = 1000
+# Columns returned by search per role; doctors only ever see anonymized data
+SEARCH_COLUMNS = {
+    'admin': "p.*",
+    'doctor': "p.patient_id, p.anonymized_name, p.anonymized_contact, p.diagnosis, p.date_added, p.last_updated",
+}
+
+def build_fts_query(text):
+    """Turn free text into a safe FTS5 query: every term quoted, last term as a prefix"""
+    terms = [term.replace('"', '') for term in text.split()]
+    terms = [term for term in terms if term]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+@cached_read("patients")
+def search_patients(text, role, page=0, page_size=25):
+    """Ranked full-text search over diagnosis and anonymized identifiers (CIA confidentiality)
+
+    Returns a dict with ``rows`` (projected for the role), ``page`` and
+    ``has_next``. Raw names and contacts are not indexed, so search can
+    never match on or reveal PII. Ranking covers the SEARCH_CANDIDATES
+    newest matches.
+    """
+    if role not in SEARCH_COLUMNS:
+        raise PermissionError(f"Role '{role}' may not search patients")
+    query = build_fts_query(text)
+    if query is None:
+        return {'rows': [], 'page': 0, 'has_next': False}
+    page = max(0, int(page))
+    offset = page * page_size
+    if offset >= SEARCH_CANDIDATES:
+        return {'rows': [], 'page': page, 'has_next': False}
+    with get_db_connection() as conn:
+        rows = conn.execute(f"""
+            SELECT {SEARCH_COLUMNS[role]}
+            FROM (
+                SELECT rowid, bm25(patients_fts) AS score FROM patients_fts
+                WHERE patients_fts MATCH ?
+                ORDER BY rowid DESC LIMIT ?
+            ) f
+            JOIN patients p ON p.patient_id = f.rowid
+            ORDER BY f.score, p.patient_id DESC
+            LIMIT ? OFFSET ?
+        """, (query, SEARCH_CANDIDATES, page_size + 1, offset)).fetchall()
+    has_next = len(rows) > page_size and offset + page_size < SEARCH_CANDIDATES
+    return {'rows': rows[:page_size], 'page': page, 'has_next': has_next}
+
+# ========== AGGREGATES ==========
+# Served from the trigger-maintained rollup tables, so cost scales with the
+# number of diagnoses and days rather than with patients or log rows.
+
+@cached_read("patients")
+def get_diagnosis_counts():
+    """Patients per diagnosis, largest first"""
+    with get_db_connection() as conn:
+        return conn.execute("""
+            SELECT diagnosis, patient_count FROM diagnosis_counts
+            WHERE patient_count > 0
+            ORDER BY patient_count DESC, diagnosis
+        """).fetchall()
+
+@cached_read("logs")
+def get_daily_activity(role=None, action=None):
+    """Log entries per day, optionally for one role and/or action"""
+    query = "SELECT day, SUM(log_count) AS log_count FROM log_daily_counts WHERE 1=1"
+    params = []
+    if role:
+        query += " AND role = ?"
+        params.append(role)
+    if action:
+        query += " AND action = ?"
+        params.append(action)
+    query += " GROUP BY day HAVING SUM(log_count) > 0 ORDER BY day"
+    with get_db_connection() as conn:
+        return conn.execute(query, params).fetchall()
+
+@cached_read("logs")
+def get_activity_by_role():
+    """Log entries per role"""
+    with get_db_connection() as conn:
+        return conn.execute("""
+            SELECT role, SUM(log_count) AS log_count FROM log_daily_counts
+            GROUP BY role HAVING SUM(log_count) > 0 ORDER BY log_count DESC
+        """).fetchall()
+
+@cached_read("logs")
+def get_activity_by_action():
+    """Log entries per action"""
+    with get_db_connection() as conn:
+        return conn.execute("""
+            SELECT action, SUM(log_count) AS log_count FROM log_daily_counts
+            GROUP BY action HAVING SUM(log_count) > 0 ORDER BY log_count DESC
+        """).fetchall()
+
+@cached_read("logs")
+def get_log_count():
+    """Total audit log entries"""
+    with get_db_connection() as conn:
+        return conn.execute("SELECT COALESCE(SUM(log_count), 0) FROM log_daily_counts").fetchone()[0]
+
+def get_action_count(action=None, day=None):
+    """Entries for one day (default today), optionally one action; reads only that day's counters"""
+    # Resolve today here so the day is part of the cache key and midnight starts a new entry
+    return _get_day_action_count(day or datetime.now().strftime("%Y-%m-%d"), action)
+
+@cached_read("logs")
+def _get_day_action_count(day, action=None):
+    query = "SELECT COALESCE(SUM(log_count), 0) FROM log_daily_counts WHERE day = ?"
+    params = [day]
+    if action:
+        query += " AND action = ?"
+        params.append(action)
+    with get_db_connection() as conn:
+        return conn.execute(query, params).fetchone()[0]
+
+def get_recent_action_count(action, minutes):
+    """Entries for an action in the last N minutes, from the per-minute counters"""
+    since = (datetime.now() - timedelta(minutes=minutes - 1)).strftime("%Y-%m-%d %H:%M")
+    with get_db_connection() as conn:
+        return conn.execute("""
+            SELECT COALESCE(SUM(log_count), 0) FROM log_minute_counts
+            WHERE minute >= ? AND action = ?
+        """, (since, action)).fetchone()[0]
+
+def prune_minute_counts(keep_minutes=RATE_COUNTER_MINUTES):
+    """Drop per-minute counters older than the alert window"""
+    before = (datetime.now() - timedelta(minutes=keep_minutes)).strftime("%Y-%m-%d %H:%M")
+    with get_db_connection() as conn:
+        cursor = conn.execute("DELETE FROM log_minute_counts WHERE minute < ?", (before,))
+        conn.commit()
+        return cursor.rowcount
+
+# (action, window minutes, max entries in the window)
+RATE_ALERT_RULES = [
+    ("LOGIN", 5, 20),
+    ("DECRYPT_DATA", 10, 30),
+    ("EXPORT_DATA", 60, 10),
+]
+ANOMALY_ACTIONS = ("LOGIN", "DECRYPT_DATA", "EXPORT_DATA")
+ANOMALY_BASELINE_DAYS = 7
+ANOMALY_FACTOR = 3.0  # today above 3x the trailing daily mean
+ANOMALY_MIN_COUNT = 20  # ignore spikes on tiny volumes
+
+def get_activity_alerts():
+    """Rate and volume alerts computed from the counter tables (no log scans)
+
+    Returns a list of dicts with kind ('rate' or 'anomaly'), action, count,
+    threshold and a human readable message.
+    """
+    alerts = []
+    for action, minutes, limit in RATE_ALERT_RULES:
+        count = get_recent_action_count(action, minutes)
+        if count > limit:
+            alerts.append({'kind': 'rate', 'action': action, 'count': count, 'threshold': limit,
+                           'message': f"{count} {action} events in the last {minutes} min (limit {limit})"})
+    today = datetime.now()
+    first = (today - timedelta(days=ANOMALY_BASELINE_DAYS)).strftime("%Y-%m-%d")
+    with get_db_connection() as conn:
+        rows = conn.execute(f"""
+            SELECT action,
+                   SUM(CASE WHEN day = ? THEN log_count ELSE 0 END) AS today,
+                   SUM(CASE WHEN day < ? THEN log_count ELSE 0 END) AS baseline
+            FROM log_daily_counts
+            WHERE day >= ? AND action IN ({", ".join("?" * len(ANOMALY_ACTIONS))})
+            GROUP BY action
+        """, [today.strftime("%Y-%m-%d"), today.strftime("%Y-%m-%d"), first, *ANOMALY_ACTIONS]).fetchall()
+    for row in rows:
+        threshold = ANOMALY_FACTOR * row['baseline'] / ANOMALY_BASELINE_DAYS
+        if row['today'] >= ANOMALY_MIN_COUNT and row['today'] > threshold:
+            alerts.append({'kind': 'anomaly', 'action': row['action'], 'count': row['today'],
+                           'threshold': threshold,
+                           'message': f"{row['today']} {row['action']} events today vs. "
+                                      f"{row['baseline'] / ANOMALY_BASELINE_DAYS:.1f}/day over the last {ANOMALY_BASELINE_DAYS} days"})
+    return alerts
+
+def add_patient(name, contact, diagnosis, anon_name, anon_contact, enc_name="", enc_contact="", key_version=None):
     """Add new patient with anonymization (GDPR data minimization)"""
     with get_db_connection() as conn:
         cursor = conn.cursor()
         date_added = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # Rows inserted already encrypted count as anonymized at row_version 1
+        anonymized_version = 1 if enc_name and enc_contact else None
         cursor.execute("""
             INSERT INTO patients 
             (name, contact, diagnosis, anonymized_name, anonymized_contact, 
-             encrypted_name, encrypted_contact, date_added)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (name, contact, diagnosis, anon_name, anon_contact, enc_name, enc_contact, date_added))
+             encrypted_name, encrypted_contact, date_added,
+             last_updated, row_version, anonymized_version, key_version)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?)
+        """, (name, contact, diagnosis, anon_name, anon_contact, enc_name, enc_contact, date_added,
+              date_added, anonymized_version, key_version))
         conn.commit()
-        return cursor.lastrowid
+    bump_generation("patients")
+    return cursor.lastrowid
+
+def register_patient(name, contact, diagnosis, cipher=None):
+    """Register a patient atomically: masked, encrypted and numbered in one transaction
+
+    The anonymized name depends on the new patient_id, so the INSERT and
+    the follow-up UPDATE share one transaction; readers never see a
+    placeholder name.
+    """
+    date_added = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    enc_name = cipher.encrypt(name.encode()).decode() if cipher else ""
+    enc_contact = cipher.encrypt(contact.encode()).decode() if cipher else ""
+    with get_db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.execute("""
+            INSERT INTO patients 
+            (name, contact, diagnosis, anonymized_contact, encrypted_name, encrypted_contact,
+             date_added, last_updated, row_version, anonymized_version, key_version)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?)
+        """, (name, contact, diagnosis, mask_contact(contact), enc_name, enc_contact,
+              date_added, date_added, 1 if cipher else None, getattr(cipher, 'version', None)))
+        pid = cursor.lastrowid
+        conn.execute("UPDATE patients SET anonymized_name=? WHERE patient_id=?", (mask_name(pid), pid))
+        conn.commit()
+    bump_generation("patients")
+    return pid
 
 def update_patient(patient_id, name, contact, diagnosis, anon_name, anon_contact):
     """Update patient record with validation (CIA integrity)"""
     with get_db_connection() as conn:
         cursor = conn.cursor()
+        last_updated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # Bumping row_version marks the row dirty for incremental anonymization
         cursor.execute("""
             UPDATE patients 
-            SET name=?, contact=?, diagnosis=?, anonymized_name=?, anonymized_contact=?
+            SET name=?, contact=?, diagnosis=?, anonymized_name=?, anonymized_contact=?,
+                last_updated=?, row_version=row_version+1
             WHERE patient_id=?
-        """, (name, contact, diagnosis, anon_name, anon_contact, patient_id))
+        """, (name, contact, diagnosis, anon_name, anon_contact, last_updated, patient_id))
         conn.commit()
+    bump_generation("patients")
+
+# Chunking for the anonymization pipeline
+DIRTY_PATIENTS_PREDICATE = "anonymized_version IS NOT row_version"
+ANONYMIZE_CHUNK_SIZE = 2000
+ANONYMIZE_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+_worker_cipher = None
+
+def _init_cipher_worker(cipher):
+    """Process pool initializer: keep one cipher per worker instead of pickling it per chunk"""
+    global _worker_cipher
+    _worker_cipher = cipher
+
+def _anonymize_chunk(rows, cipher=None):
+    """Mask and encrypt a chunk of (patient_id, name, contact, row_version) rows into UPDATE parameters"""
+    cipher = cipher or _worker_cipher
+    params = []
+    for pid, name, contact, row_version in rows:
+        anon_name = f"ANON_{pid:04d}"
+        anon_contact = "XXX-XXX-" + contact[-4:] if len(contact) >= 4 else "XXX-XXX-XXXX"
+        
+        # Optional Fernet encryption for reversible anonymization (bonus)
+        enc_name = cipher.encrypt(name.encode()).decode() if cipher else ""
+        enc_contact = cipher.encrypt(contact.encode()).decode() if cipher else ""
+        key_version = getattr(cipher, 'version', None)
+        params.append((anon_name, anon_contact, enc_name, enc_contact, row_version, key_version, pid, row_version))
+    return params
 
-def anonymize_all_patients(cipher):
-    """Batch anonymize all patients with optional encryption (bonus feature)"""
+def _read_anonymize_chunk(conn, after_id, chunk_size, only_dirty=True):
+    """Next chunk of patients in patient_id order after the checkpoint"""
+    if only_dirty:
+        # Matches the partial index idx_patients_dirty
+        cursor = conn.execute(f"""
+            SELECT patient_id, name, contact, row_version FROM patients
+            WHERE {DIRTY_PATIENTS_PREDICATE} AND patient_id > ?
+            ORDER BY patient_id LIMIT ?
+        """, (after_id, chunk_size))
+    else:
+        cursor = conn.execute(
+            "SELECT patient_id, name, contact, row_version FROM patients WHERE patient_id > ? ORDER BY patient_id LIMIT ?",
+            (after_id, chunk_size)
+        )
+    return [tuple(row) for row in cursor.fetchall()]
+
+def _write_anonymize_chunk(conn, run_id, params):
+    """Write one chunk and advance the checkpoint in the same short transaction"""
+    # The row_version guard leaves rows edited mid-run dirty for the next run
+    conn.executemany("""
+        UPDATE patients 
+        SET anonymized_name=?, anonymized_contact=?, encrypted_name=?, encrypted_contact=?,
+            anonymized_version=?, key_version=?
+        WHERE patient_id=? AND row_version=?
+    """, params)
+    conn.execute("""
+        UPDATE anonymization_runs
+        SET last_patient_id=?, rows_done=rows_done+?, updated_at=?
+        WHERE run_id=?
+    """, (params[-1][-2], len(params), datetime.now().strftime("%Y-%m-%d %H:%M:%S"), run_id))
+    conn.commit()
+    bump_generation("patients")
+
+def _run_chunk_pipeline(read_chunk, transform, write_chunk, first, cipher, workers, chunk_size):
+    """Transform chunks (inline, or on a process pool when there is more than one) and write them in order
+
+    read_chunk(last_row) returns the chunk after last_row, transform(rows,
+    cipher) builds write parameters and write_chunk(params) commits them.
+    Returns the number of rows written.
+    """
+    rows_done = 0
+    use_pool = cipher is not None and workers > 1 and len(first) == chunk_size
+    if not use_pool:
+        chunk = first
+        while chunk:
+            params = transform(chunk, cipher)
+            write_chunk(params)
+            rows_done += len(params)
+            chunk = read_chunk(chunk[-1])
+        return rows_done
+    # Keep a bounded number of chunks in flight; write them back in order
+    # spawn, not fork: the Streamlit server process is multi-threaded
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                             initializer=_init_cipher_worker, initargs=(cipher,)) as pool:
+        pending = deque()
+        chunk = first
+        while chunk or pending:
+            while chunk and len(pending) < workers * 2:
+                pending.append(pool.submit(transform, chunk))
+                chunk = read_chunk(chunk[-1])
+            params = pending.popleft().result()
+            write_chunk(params)
+            rows_done += len(params)
+    return rows_done
+
+def _start_or_resume_anonymize_run(conn):
+    """Return (run_id, last_patient_id, resumed) for the unfinished run, or start a new one"""
+    row = conn.execute("""
+        SELECT run_id, last_patient_id FROM anonymization_runs
+        WHERE completed_at IS NULL ORDER BY run_id DESC LIMIT 1
+    """).fetchone()
+    if row:
+        return row['run_id'], row['last_patient_id'], True
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cursor = conn.execute(
+        "INSERT INTO anonymization_runs (started_at, updated_at) VALUES (?, ?)", (now, now)
+    )
+    conn.commit()
+    return cursor.lastrowid, 0, False
+
+def count_dirty_patients():
+    """Number of patients added or changed since they were last anonymized"""
     with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT patient_id, name, contact FROM patients")
-        patients = cursor.fetchall()
+        return conn.execute(f"SELECT COUNT(*) FROM patients WHERE {DIRTY_PATIENTS_PREDICATE}").fetchone()[0]
+
+def anonymize_all_patients(cipher, chunk_size=ANONYMIZE_CHUNK_SIZE, workers=ANONYMIZE_WORKERS, only_dirty=True):
+    """Batch anonymize all patients with optional encryption (bonus feature)
+
+    By default only rows whose row_version is ahead of their
+    anonymized_version are processed, so routine runs cost O(changes);
+    pass only_dirty=False to re-encrypt the whole table.
+
+    Rows are processed in patient_id chunks: encryption runs on a process
+    pool and each chunk is written with executemany in its own transaction
+    together with a checkpoint, so an interrupted run resumes where it
+    stopped. Returns a dict with rows processed, elapsed seconds and rows/s.
+    """
+    started = time.perf_counter()
+    with get_db_connection() as conn:
+        run_id, last_id, resumed = _start_or_resume_anonymize_run(conn)
         
-        for patient in patients:
-            pid = patient['patient_id']
-            anon_name = f"ANON_{pid:04d}"
-            anon_contact = "XXX-XXX-" + patient['contact'][-4:] if len(patient['contact']) >= 4 else "XXX-XXX-XXXX"
-            
-            # Optional Fernet encryption for reversible anonymization (bonus)
-            enc_name = cipher.encrypt(patient['name'].encode()).decode() if cipher else ""
-            enc_contact = cipher.encrypt(patient['contact'].encode()).decode() if cipher else ""
-            
-            cursor.execute("""
-                UPDATE patients 
-                SET anonymized_name=?, anonymized_contact=?, encrypted_name=?, encrypted_contact=?
-                WHERE patient_id=?
-            """, (anon_name, anon_contact, enc_name, enc_contact, pid))
+        rows_done = _run_chunk_pipeline(
+            lambda last: _read_anonymize_chunk(conn, last[0], chunk_size, only_dirty),
+            _anonymize_chunk,
+            lambda params: _write_anonymize_chunk(conn, run_id, params),
+            _read_anonymize_chunk(conn, last_id, chunk_size, only_dirty),
+            cipher, workers, chunk_size
+        )
         
+        conn.execute(
+            "UPDATE anonymization_runs SET completed_at=? WHERE run_id=?",
+            (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), run_id)
+        )
         conn.commit()
+    
+    elapsed = time.perf_counter() - started
+    return {
+        'rows': rows_done,
+        'seconds': elapsed,
+        'rows_per_sec': rows_done / elapsed if elapsed > 0 else 0.0,
+        'resumed': resumed
+    }
+
+# ========== KEY ROTATION ==========
+
+def _reencrypt_chunk(rows, cipher=None):
+    """Re-encrypt (patient_id, encrypted_name, encrypted_contact) rows under the primary key"""
+    cipher = cipher or _worker_cipher
+    params = []
+    for pid, enc_name, enc_contact in rows:
+        new_name = cipher.rotate(enc_name.encode()).decode()
+        new_contact = cipher.rotate(enc_contact.encode()).decode() if enc_contact else enc_contact
+        params.append((new_name, new_contact, cipher.version, pid, enc_name))
+    return params
+
+def _read_reencrypt_chunk(conn, after_id, chunk_size, key_version):
+    """Next chunk of encrypted patients not yet on key_version"""
+    cursor = conn.execute("""
+        SELECT patient_id, encrypted_name, encrypted_contact FROM patients
+        WHERE key_version IS NOT ? AND encrypted_name <> '' AND patient_id > ?
+        ORDER BY patient_id LIMIT ?
+    """, (key_version, after_id, chunk_size))
+    return [tuple(row) for row in cursor.fetchall()]
+
+def _write_reencrypt_chunk(conn, params):
+    """Write one re-encrypted chunk in its own short transaction"""
+    # Guard on the old ciphertext so a concurrent anonymization write is never overwritten
+    conn.executemany("""
+        UPDATE patients SET encrypted_name=?, encrypted_contact=?, key_version=?
+        WHERE patient_id=? AND encrypted_name=?
+    """, params)
+    conn.commit()
+    bump_generation("patients")
+
+@cached_read("patients")
+def count_patients_pending_reencryption(key_version):
+    """Encrypted patients whose ciphertext is not yet under key_version"""
+    with get_db_connection() as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM patients WHERE key_version IS NOT ? AND encrypted_name <> ''",
+            (key_version,)
+        ).fetchone()[0]
+
+def reencrypt_all_patients(cipher, chunk_size=ANONYMIZE_CHUNK_SIZE, workers=ANONYMIZE_WORKERS):
+    """Move encrypted_name/encrypted_contact to the cipher's primary key (after crypto_utils.rotate_key)
+
+    cipher must be a crypto_utils.VersionedMultiFernet holding the old keys
+    too. Chunks commit independently and finished rows are recorded in
+    key_version, so the app stays online and an interrupted job resumes.
+    """
+    started = time.perf_counter()
+    with get_db_connection() as conn:
+        rows_done = _run_chunk_pipeline(
+            lambda last: _read_reencrypt_chunk(conn, last[0], chunk_size, cipher.version),
+            _reencrypt_chunk,
+            lambda params: _write_reencrypt_chunk(conn, params),
+            _read_reencrypt_chunk(conn, 0, chunk_size, cipher.version),
+            cipher, workers, chunk_size
+        )
+    elapsed = time.perf_counter() - started
+    return {
+        'rows': rows_done,
+        'seconds': elapsed,
+        'rows_per_sec': rows_done / elapsed if elapsed > 0 else 0.0
+    }
+
+# ========== BULK IMPORT ==========
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_FIELDS = ('name', 'contact', 'diagnosis')
+MAX_FIELD_LENGTHS = {'name': 200, 'contact': 50, 'diagnosis': 2000}
+
+def validate_patient_record(record):
+    """Return (name, contact, diagnosis) stripped, or raise ValueError (CIA integrity)"""
+    values = []
+    for field in IMPORT_FIELDS:
+        value = (record.get(field) or "").strip()
+        if not value:
+            raise ValueError(f"missing {field}")
+        if len(value) > MAX_FIELD_LENGTHS[field]:
+            raise ValueError(f"{field} longer than {MAX_FIELD_LENGTHS[field]} characters")
+        values.append(value)
+    return tuple(values)
+
+def _prepare_import_chunk(rows, cipher=None):
+    """Mask and encrypt validated (name, contact, diagnosis) rows into INSERT parameters"""
+    cipher = cipher or _worker_cipher
+    date_added = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    anonymized_version = 1 if cipher else None
+    key_version = getattr(cipher, 'version', None)
+    params = []
+    for name, contact, diagnosis in rows:
+        enc_name = cipher.encrypt(name.encode()).decode() if cipher else ""
+        enc_contact = cipher.encrypt(contact.encode()).decode() if cipher else ""
+        params.append((name, contact, diagnosis, mask_contact(contact), enc_name, enc_contact,
+                       date_added, date_added, anonymized_version, key_version))
+    return params
+
+def _write_import_chunk(conn, params):
+    """Insert one chunk and number its anonymized names in the same transaction"""
+    conn.execute("BEGIN IMMEDIATE")
+    last_id = conn.execute("SELECT COALESCE(MAX(patient_id), 0) FROM patients").fetchone()[0]
+    conn.executemany("""
+        INSERT INTO patients 
+        (name, contact, diagnosis, anonymized_contact, encrypted_name, encrypted_contact,
+         date_added, last_updated, row_version, anonymized_version, key_version)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?)
+    """, params)
+    # Same format as crypto_utils.mask_name
+    conn.execute("""
+        UPDATE patients SET anonymized_name = printf('ANON_%04d', patient_id)
+        WHERE patient_id > ? AND anonymized_name IS NULL
+    """, (last_id,))
+    conn.commit()
+    bump_generation("patients")
+
+def import_patients(records, cipher=None, chunk_size=IMPORT_CHUNK_SIZE, workers=ANONYMIZE_WORKERS):
+    """Validate, encrypt and insert patient records (dicts with name/contact/diagnosis) in chunks
+
+    Invalid records are skipped and reported as (record number, message).
+    Each chunk is committed in its own transaction. Returns a dict with
+    imported, skipped, errors and rows_per_sec.
+    """
+    started = time.perf_counter()
+    errors = []
+    
+    def valid_rows():
+        for number, record in enumerate(records, start=1):
+            try:
+                yield validate_patient_record(record)
+            except ValueError as e:
+                errors.append((number, str(e)))
+    
+    rows = valid_rows()
+    
+    def next_chunk(_last=None):
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                break
+        return chunk
+    
+    with get_db_connection() as conn:
+        imported = _run_chunk_pipeline(
+            next_chunk,
+            _prepare_import_chunk,
+            lambda params: _write_import_chunk(conn, params),
+            next_chunk(),
+            cipher, workers, chunk_size
+        )
+    elapsed = time.perf_counter() - started
+    return {
+        'imported': imported,
+        'skipped': len(errors),
+        'errors': errors,
+        'seconds': elapsed,
+        'rows_per_sec': imported / elapsed if elapsed > 0 else 0.0
+    }
+
+def import_patients_csv(csv_file, cipher=None, chunk_size=IMPORT_CHUNK_SIZE):
+    """Stream a CSV with name, contact, diagnosis columns into import_patients
+
+    csv_file may be a path or a binary/text file object; the file is read row by row.
+    """
+    if isinstance(csv_file, (str, os.PathLike)):
+        with open(csv_file, newline='', encoding='utf-8-sig') as f:
+            return import_patients_csv(f, cipher, chunk_size)
+    if not isinstance(csv_file, io.TextIOBase):
+        csv_file = io.TextIOWrapper(csv_file, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(csv_file)
+    missing = [field for field in IMPORT_FIELDS if field not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"CSV is missing column(s): {', '.join(missing)}")
+    return import_patients(reader, cipher, chunk_size)
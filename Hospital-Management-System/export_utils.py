@@ -0,0 +1,131 @@
+import csv
+import gzip
+import io
+import os
+from datetime import datetime
+
+from database import get_read_connection
+from shard_utils import PATIENT_SHARDS, shard_path
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = None
+    pq = None
+
+EXPORT_CHUNK_SIZE = 5000
+BACKUP_DIR = "backups"
+
+# Columns each role may export (GDPR data minimization); missing role = no access
+EXPORT_COLUMNS = {
+    'patients': {
+        'admin': ['patient_id', 'name', 'contact', 'diagnosis', 'anonymized_name',
+                  'anonymized_contact', 'encrypted_name', 'encrypted_contact',
+                  'date_added', 'last_updated'],
+        'doctor': ['patient_id', 'anonymized_name', 'anonymized_contact', 'diagnosis', 'date_added'],
+    },
+    'logs': {
+        'admin': ['log_id', 'user_id', 'username', 'role', 'action', 'timestamp', 'details'],
+    },
+}
+
+INTEGER_COLUMNS = {'patient_id', 'log_id', 'user_id'}
+
+EXPORT_QUERIES = {
+    'patients': "SELECT {columns} FROM patients ORDER BY patient_id",
+    'logs': """
+        SELECT {columns} FROM logs l
+        LEFT JOIN users u ON l.user_id = u.user_id
+        ORDER BY l.log_id
+    """,
+}
+
+# logs columns are qualified because of the users join
+LOG_COLUMN_SOURCES = {'username': 'u.username'}
+
+
+def get_export_columns(dataset, role):
+    """Columns the role may export, or raise PermissionError (CIA confidentiality)"""
+    if dataset not in EXPORT_COLUMNS:
+        raise ValueError(f"Unknown dataset: {dataset}")
+    columns = EXPORT_COLUMNS[dataset].get(role)
+    if not columns:
+        raise PermissionError(f"Role '{role}' may not export {dataset}")
+    return columns
+
+
+def iter_export_chunks(dataset, role, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield (columns, rows) chunks from a single streaming cursor; memory stays O(chunk_size)"""
+    columns = get_export_columns(dataset, role)
+    if dataset == 'logs':
+        select = ", ".join(LOG_COLUMN_SOURCES.get(c, f"l.{c}") for c in columns)
+    else:
+        select = ", ".join(columns)
+    # Patients are read shard by shard; logs live in the main database only
+    paths = [shard_path(shard) for shard in range(PATIENT_SHARDS)] if dataset == 'patients' else [None]
+    for path in paths:
+        with get_read_connection(path) as conn:
+            cursor = conn.execute(EXPORT_QUERIES[dataset].format(columns=select))
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield columns, [tuple(row) for row in rows]
+
+
+def write_csv(dataset, role, path, compress=False, chunk_size=EXPORT_CHUNK_SIZE):
+    """Stream a dataset to CSV (optionally gzip) and return the number of rows written"""
+    opener = gzip.open if compress else open
+    count = 0
+    with opener(path, 'wt', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(get_export_columns(dataset, role))
+        for _, rows in iter_export_chunks(dataset, role, chunk_size):
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def write_parquet(dataset, role, path, chunk_size=EXPORT_CHUNK_SIZE):
+    """Stream a dataset to Parquet one row group per chunk and return the number of rows written"""
+    if pa is None:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+    columns = get_export_columns(dataset, role)
+    schema = pa.schema([
+        (c, pa.int64() if c in INTEGER_COLUMNS else pa.string()) for c in columns
+    ])
+    count = 0
+    with pq.ParquetWriter(path, schema, compression='snappy') as writer:
+        for _, rows in iter_export_chunks(dataset, role, chunk_size):
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            count += len(rows)
+    return count
+
+
+def export_dataset(dataset, role, fmt="csv", directory=BACKUP_DIR):
+    """Export to a timestamped file under directory; returns (path, rows)"""
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    extension = {'csv': 'csv', 'csv.gz': 'csv.gz', 'parquet': 'parquet'}[fmt]
+    path = os.path.join(directory, f"{dataset}_{role}_{stamp}.{extension}")
+    if fmt == 'parquet':
+        rows = write_parquet(dataset, role, path)
+    else:
+        rows = write_csv(dataset, role, path, compress=fmt == 'csv.gz')
+    return path, rows
+
+
+def iter_csv_bytes(dataset, role, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the CSV export as encoded byte chunks, for streaming HTTP responses"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(get_export_columns(dataset, role))
+    for _, rows in iter_export_chunks(dataset, role, chunk_size):
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
@@ -0,0 +1,193 @@
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+from datetime import datetime
+
+from database import get_db_connection, get_read_connection, get_setting, compute_log_hash, LOG_CHAIN_GENESIS
+
+# Audit log integrity (CIA integrity): hash chain + HMAC-signed checkpoints
+AUDIT_KEY_FILE = "audit.key"
+VERIFY_CHUNK_SIZE = 5000
+
+CHECKPOINT_FIELDS = ('last_log_id', 'last_hash', 'rows_verified', 'status', 'broken_log_id', 'checked_at')
+
+_verify_lock = threading.Lock()
+
+
+def get_audit_key():
+    """Load or create the secret used to sign verification checkpoints"""
+    if os.path.exists(AUDIT_KEY_FILE):
+        with open(AUDIT_KEY_FILE, 'rb') as f:
+            return f.read()
+    key = secrets.token_bytes(32)
+    fd = os.open(AUDIT_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+def sign_checkpoint(checkpoint):
+    """HMAC-SHA256 over a checkpoint's fields"""
+    message = json.dumps([checkpoint[field] for field in CHECKPOINT_FIELDS]).encode("utf-8")
+    return hmac.new(get_audit_key(), message, hashlib.sha256).hexdigest()
+
+
+def checkpoint_is_authentic(checkpoint):
+    return hmac.compare_digest(checkpoint['signature'], sign_checkpoint(checkpoint))
+
+
+def get_last_checkpoint():
+    """Most recent verification result as a dict (with 'authentic'), or None if never verified"""
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT * FROM log_checkpoints ORDER BY checkpoint_id DESC LIMIT 1").fetchone()
+    if row is None:
+        return None
+    checkpoint = dict(row)
+    checkpoint['authentic'] = checkpoint_is_authentic(checkpoint)
+    return checkpoint
+
+
+def get_verified_checkpoint():
+    """Latest successful checkpoint whose signature checks out, or None
+
+    After a broken result only checkpoints from before the break count, so
+    a detected break keeps being reported until the entry is restored.
+    """
+    last = get_last_checkpoint()
+    before = last['broken_log_id'] if last and last['status'] == 'broken' else None
+    with get_db_connection() as conn:
+        row = conn.execute("""
+            SELECT * FROM log_checkpoints
+            WHERE status = 'ok' AND (? IS NULL OR last_log_id < ?)
+            ORDER BY checkpoint_id DESC LIMIT 1
+        """, (before, before)).fetchone()
+    if row is None or not checkpoint_is_authentic(row):
+        return None
+    return dict(row)
+
+
+def _save_checkpoint(checkpoint, replace_id=None):
+    checkpoint['signature'] = sign_checkpoint(checkpoint)
+    values = [checkpoint[field] for field in CHECKPOINT_FIELDS] + [checkpoint['signature']]
+    with get_db_connection() as conn:
+        if replace_id is None:
+            cursor = conn.execute("""
+                INSERT INTO log_checkpoints
+                (last_log_id, last_hash, rows_verified, status, broken_log_id, checked_at, signature)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, values)
+            checkpoint['checkpoint_id'] = cursor.lastrowid
+        else:
+            conn.execute("""
+                UPDATE log_checkpoints
+                SET last_log_id = ?, last_hash = ?, rows_verified = ?, status = ?,
+                    broken_log_id = ?, checked_at = ?, signature = ?
+                WHERE checkpoint_id = ?
+            """, values + [replace_id])
+            checkpoint['checkpoint_id'] = replace_id
+        conn.commit()
+    return checkpoint
+
+
+def _checkpoint_tail_intact(conn, checkpoint):
+    """The entry a checkpoint ends on is still live and unchanged, or was archived"""
+    if not checkpoint['last_log_id']:
+        return True
+    row = conn.execute("SELECT entry_hash FROM logs WHERE log_id = ?", (checkpoint['last_log_id'],)).fetchone()
+    if row is not None:
+        return row['entry_hash'] == checkpoint['last_hash']
+    # Retention only moves a verified log_id prefix, so nothing at or before the tail may remain
+    archived_through = int(get_setting("log_archived_through", 0))
+    remaining = conn.execute("SELECT 1 FROM logs WHERE log_id <= ? LIMIT 1", (checkpoint['last_log_id'],)).fetchone()
+    return checkpoint['last_log_id'] <= archived_through and remaining is None
+
+
+def verify_audit_log(full=False):
+    """Re-hash log entries added since the last signed checkpoint and record the result
+
+    Only entries after the checkpoint are read, so a run costs O(new rows);
+    the checkpoint's own last entry is checked first so deleting the newest
+    entries is caught. A checkpoint with a bad signature is ignored and the
+    chain is verified from the oldest live entry (older entries may have
+    been archived). A previously reported break stays reported until the
+    walk re-verifies that entry. Returns the new checkpoint dict; status is
+    'ok' or 'broken'.
+    """
+    start = None if full else get_verified_checkpoint()
+    last = get_last_checkpoint()
+    open_break = last['broken_log_id'] if last and last['authentic'] and last['status'] == 'broken' else None
+    last_log_id = start['last_log_id'] if start else 0
+    prev_hash = start['last_hash'] if start else None
+    rows_verified = 0
+    broken_log_id = None
+    with get_read_connection() as conn:
+        if start and not _checkpoint_tail_intact(conn, start):
+            broken_log_id = start['last_log_id']
+        cursor = conn.execute("""
+            SELECT log_id, user_id, role, action, timestamp, details, prev_hash, entry_hash
+            FROM logs WHERE log_id > ? ORDER BY log_id
+        """, (last_log_id,))
+        while broken_log_id is None:
+            rows = cursor.fetchmany(VERIFY_CHUNK_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                if prev_hash is None:
+                    prev_hash = row['prev_hash'] or LOG_CHAIN_GENESIS
+                expected = compute_log_hash(prev_hash, row['user_id'], row['role'], row['action'],
+                                            row['timestamp'], row['details'])
+                if row['prev_hash'] != prev_hash or row['entry_hash'] != expected:
+                    broken_log_id = row['log_id']
+                    break
+                prev_hash = expected
+                last_log_id = row['log_id']
+                rows_verified += 1
+                if row['log_id'] == open_break:
+                    open_break = None
+    if broken_log_id is None and open_break is not None:
+        # The entry that broke the chain is still missing
+        broken_log_id = open_break
+    checkpoint = {
+        'last_log_id': last_log_id,
+        'last_hash': prev_hash or LOG_CHAIN_GENESIS,
+        'rows_verified': rows_verified,
+        'status': 'broken' if broken_log_id is not None else 'ok',
+        'broken_log_id': broken_log_id,
+        'checked_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    # The chain simply extends the latest checkpoint, or hits the same break: move it forward in place
+    replace_id = None
+    if last and last['authentic']:
+        if checkpoint['status'] == 'ok' and start and last['checkpoint_id'] == start['checkpoint_id']:
+            replace_id = last['checkpoint_id']
+        elif checkpoint['status'] == 'broken' and last['broken_log_id'] == broken_log_id:
+            replace_id = last['checkpoint_id']
+    return _save_checkpoint(checkpoint, replace_id)
+
+
+def _verify_in_background(full):
+    if not _verify_lock.acquire(blocking=False):
+        return
+    try:
+        verify_audit_log(full)
+    finally:
+        _verify_lock.release()
+
+
+def start_background_verification(full=False):
+    """Run verify_audit_log on a background thread unless one is running; returns whether it started
+
+    The first run (or a full one) re-hashes the whole table, which must not
+    block a page render.
+    """
+    if _verify_lock.locked():
+        return False
+    threading.Thread(target=_verify_in_background, args=(full,), name="audit-verify", daemon=True).start()
+    return True
+
+
+def verification_running():
+    return _verify_lock.locked()
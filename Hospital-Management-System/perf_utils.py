@@ -0,0 +1,239 @@
+import heapq
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+# Instrumentation settings
+PERF_ENABLED = True
+SAMPLE_WINDOW = 1000  # latest samples kept per statement/page for percentiles
+SLOWEST_KEPT = 20
+SLOW_QUERY_SECONDS = 0.1  # statements slower than this count against System Health
+
+_lock = threading.RLock()  # re-entrant: a cursor finalized by GC may record while the lock is held
+_query_samples = {}  # normalized sql -> deque of [seconds, rows]
+_query_counts = {}  # normalized sql -> total calls
+_page_samples = {}  # page name -> deque of seconds
+_slowest = []  # min-heap of (seconds, sql, rows, timestamp)
+_export_file = None
+
+
+def _normalize(sql):
+    return re.sub(r"\s+", " ", sql).strip()[:300]
+
+
+def _export(record):
+    if _export_file is not None:
+        _export_file.write(json.dumps(record) + "\n")
+
+
+def _record_query(sql, sample):
+    with _lock:
+        samples = _query_samples.get(sql)
+        if samples is None:
+            samples = _query_samples[sql] = deque(maxlen=SAMPLE_WINDOW)
+        samples.append(sample)
+        _query_counts[sql] = _query_counts.get(sql, 0) + 1
+
+
+def _finish_query(sql, sample):
+    """Called once a statement's rows are consumed; tracks slowest and exports"""
+    with _lock:
+        entry = (sample[0], sql, sample[1], time.time())
+        if len(_slowest) < SLOWEST_KEPT:
+            heapq.heappush(_slowest, entry)
+        elif entry[0] > _slowest[0][0]:
+            heapq.heapreplace(_slowest, entry)
+        _export({'type': 'query', 'sql': sql, 'seconds': sample[0], 'rows': sample[1], 'ts': entry[3]})
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times execute plus the fetches that follow it and counts rows"""
+
+    _sample = None
+    _sql = None
+
+    def _close_sample(self):
+        if self._sample is not None:
+            _finish_query(self._sql, self._sample)
+            self._sample = None
+
+    def close(self):
+        self._close_sample()
+        super().close()
+
+    def __del__(self):
+        # A cursor dropped after fetchone() never sees the None that would close its sample
+        self._close_sample()
+
+    def _timed(self, method, sql, *args):
+        self._close_sample()
+        if not PERF_ENABLED:
+            return method(sql, *args)
+        start = time.perf_counter()
+        result = method(sql, *args)
+        elapsed = time.perf_counter() - start
+        self._sql = _normalize(sql)
+        # rowcount is -1 for SELECT; fetched rows are added by the fetch methods
+        self._sample = [elapsed, max(self.rowcount, 0)]
+        _record_query(self._sql, self._sample)
+        if self.description is None:
+            self._close_sample()
+        return result
+
+    def execute(self, sql, parameters=()):
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(super().executemany, sql, seq_of_parameters)
+
+    def _timed_fetch(self, method, *args):
+        if self._sample is None:
+            return method(*args)
+        start = time.perf_counter()
+        rows = method(*args)
+        self._sample[0] += time.perf_counter() - start
+        if isinstance(rows, list):
+            self._sample[1] += len(rows)
+            if not rows or method.__name__ == 'fetchall':
+                self._close_sample()
+        elif rows is None:
+            self._close_sample()
+        else:
+            self._sample[1] += 1
+        return rows
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, size if size is not None else self.arraysize)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+    def __next__(self):
+        if self._sample is None:
+            return super().__next__()
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._sample[0] += time.perf_counter() - start
+            self._close_sample()
+            raise
+        self._sample[0] += time.perf_counter() - start
+        self._sample[1] += 1
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors (including Connection.execute shortcuts) are instrumented"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def timed_page(name):
+    """Decorator recording the render time of a Streamlit page function"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PERF_ENABLED:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with _lock:
+                    samples = _page_samples.get(name)
+                    if samples is None:
+                        samples = _page_samples[name] = deque(maxlen=SAMPLE_WINDOW)
+                    samples.append(elapsed)
+                    _export({'type': 'page', 'page': name, 'seconds': elapsed, 'ts': time.time()})
+        return wrapper
+    return decorator
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def get_query_stats():
+    """Per-statement call count, p50/p95 latency (seconds) and mean rows, slowest p95 first"""
+    with _lock:
+        snapshot = {sql: [list(s) for s in samples] for sql, samples in _query_samples.items()}
+        counts = dict(_query_counts)
+    stats = []
+    for sql, samples in snapshot.items():
+        seconds = [s[0] for s in samples]
+        stats.append({
+            'sql': sql,
+            'calls': counts[sql],
+            'p50_ms': _percentile(seconds, 50) * 1000,
+            'p95_ms': _percentile(seconds, 95) * 1000,
+            'mean_rows': sum(s[1] for s in samples) / len(samples),
+        })
+    return sorted(stats, key=lambda s: s['p95_ms'], reverse=True)
+
+
+def get_page_stats():
+    """Per-page render count and p50/p95 latency, slowest p95 first"""
+    with _lock:
+        snapshot = {name: list(samples) for name, samples in _page_samples.items()}
+    stats = [{
+        'page': name,
+        'renders': len(samples),
+        'p50_ms': _percentile(samples, 50) * 1000,
+        'p95_ms': _percentile(samples, 95) * 1000,
+    } for name, samples in snapshot.items()]
+    return sorted(stats, key=lambda s: s['p95_ms'], reverse=True)
+
+
+def get_slowest_queries():
+    """The slowest individual statements seen, slowest first"""
+    with _lock:
+        entries = sorted(_slowest, reverse=True)
+    return [{'sql': sql, 'ms': seconds * 1000, 'rows': rows, 'at': at} for seconds, sql, rows, at in entries]
+
+
+def get_health_percent():
+    """Share of recent statements faster than SLOW_QUERY_SECONDS (None before any query)"""
+    with _lock:
+        seconds = [s[0] for samples in _query_samples.values() for s in samples]
+    if not seconds:
+        return None
+    fast = sum(1 for s in seconds if s < SLOW_QUERY_SECONDS)
+    return 100.0 * fast / len(seconds)
+
+
+def set_jsonl_export(path):
+    """Append every query/page sample to a JSON-lines file; None stops exporting"""
+    global _export_file
+    with _lock:
+        if _export_file is not None:
+            _export_file.close()
+        _export_file = open(path, "a", buffering=1) if path else None
+
+
+def reset_stats():
+    """Clear all collected samples"""
+    with _lock:
+        _query_samples.clear()
+        _query_counts.clear()
+        _page_samples.clear()
+        _slowest.clear()
@@ -0,0 +1,178 @@
+import glob
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import (
+    get_db_connection, get_setting, set_setting, build_log_filters,
+    encode_page_token, decode_page_token, prune_minute_counts, prune_changes
+)
+from cache_utils import bump_generation
+from integrity_utils import verify_audit_log
+from perf_utils import InstrumentedConnection
+
+# Audit log retention (GDPR storage limitation, Article 5(1)(e))
+ARCHIVE_DIR = "archive"
+DEFAULT_RETENTION_DAYS = 365
+ARCHIVE_BATCH_SIZE = 500  # rows per delete transaction; keeps write locks short
+RETENTION_RUN_INTERVAL = 24 * 60 * 60  # automatic runs at most once a day
+
+_retention_lock = threading.Lock()
+
+
+def get_retention_days():
+    """Configured audit log retention in days"""
+    return int(get_setting("log_retention_days", DEFAULT_RETENTION_DAYS))
+
+
+def set_retention_days(days):
+    """Configure how long audit logs stay in the live table"""
+    if int(days) < 1:
+        raise ValueError("Retention must be at least one day")
+    set_setting("log_retention_days", int(days))
+
+
+def archive_path(month):
+    """Archive database file for a YYYY-MM month"""
+    return os.path.join(ARCHIVE_DIR, f"logs_{month}.db")
+
+
+def list_archive_months():
+    """Archived months, newest first"""
+    paths = glob.glob(os.path.join(ARCHIVE_DIR, "logs_*.db"))
+    return sorted((os.path.basename(p)[5:-3] for p in paths), reverse=True)
+
+
+def _open_archive(month, create=False):
+    if create:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        conn = sqlite3.connect(archive_path(month), factory=InstrumentedConnection)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS logs (
+                log_id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                username TEXT,
+                role TEXT NOT NULL,
+                action TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                details TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs(timestamp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_action_role_timestamp ON logs(action, role, timestamp)")
+    else:
+        conn = sqlite3.connect(f"file:{archive_path(month)}?mode=ro", uri=True, factory=InstrumentedConnection)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def archive_old_logs(max_age_days=None, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move log rows older than max_age_days into per-month archive databases
+
+    Each batch is first committed to its month's archive (INSERT OR IGNORE,
+    so a retried batch is harmless) and then deleted from the live table in
+    its own short transaction. Only a log_id prefix that is older than the
+    cutoff and already covered by a successful integrity check is moved, so
+    the live table's hash chain stays contiguous. Returns the number of rows moved.
+    """
+    if max_age_days is None:
+        max_age_days = get_retention_days()
+    cutoff = (datetime.now() - timedelta(days=max_age_days)).strftime("%Y-%m-%d %H:%M:%S")
+    moved = 0
+    with _retention_lock:
+        checkpoint = verify_audit_log()
+        # On a broken chain only entries before the break are archived
+        archive_through = checkpoint['last_log_id']
+        with get_db_connection() as conn:
+            first_recent = conn.execute("SELECT MIN(log_id) FROM logs WHERE timestamp >= ?", (cutoff,)).fetchone()[0]
+        if first_recent is not None:
+            archive_through = min(archive_through, first_recent - 1)
+        archives = {}
+        try:
+            while True:
+                with get_db_connection() as conn:
+                    rows = conn.execute("""
+                        SELECT l.log_id, l.user_id, u.username, l.role, l.action, l.timestamp, l.details
+                        FROM logs l LEFT JOIN users u ON l.user_id = u.user_id
+                        WHERE l.log_id <= ?
+                        ORDER BY l.log_id
+                        LIMIT ?
+                    """, (archive_through, batch_size)).fetchall()
+                if not rows:
+                    break
+                by_month = {}
+                for row in rows:
+                    by_month.setdefault(row['timestamp'][:7], []).append(tuple(row))
+                for month, month_rows in by_month.items():
+                    archive = archives.get(month)
+                    if archive is None:
+                        archive = archives[month] = _open_archive(month, create=True)
+                    archive.executemany(
+                        "INSERT OR IGNORE INTO logs VALUES (?, ?, ?, ?, ?, ?, ?)", month_rows
+                    )
+                    archive.commit()
+                with get_db_connection() as conn:
+                    conn.executemany("DELETE FROM logs WHERE log_id = ?", [(row['log_id'],) for row in rows])
+                    conn.commit()
+                # Verification accepts a missing checkpoint tail only up to here
+                set_setting("log_archived_through", rows[-1]['log_id'])
+                bump_generation("logs")
+                moved += len(rows)
+                time.sleep(0)  # let waiting writers in between batches
+        finally:
+            for archive in archives.values():
+                archive.close()
+    prune_minute_counts()
+    prune_changes()
+    set_setting("retention_last_run", int(time.time()))
+    return moved
+
+
+def maybe_run_retention():
+    """Start a background archive run if none ran in the last RETENTION_RUN_INTERVAL"""
+    last_run = int(get_setting("retention_last_run", 0))
+    if time.time() - last_run < RETENTION_RUN_INTERVAL or _retention_lock.locked():
+        return False
+    # Record the attempt first so concurrent reruns do not all start a run
+    set_setting("retention_last_run", int(time.time()))
+    threading.Thread(target=archive_old_logs, name="log-retention", daemon=True).start()
+    return True
+
+
+def get_archived_logs_page(action=None, role=None, user_id=None, start=None, end=None,
+                           page_token=None, page_size=100):
+    """Query archived logs with the same filters and page tokens as database.get_logs_page
+
+    Only months overlapping [start, end) are opened, newest first, until the page is full.
+    """
+    rows = []
+    newest = end[:7] if end else None
+    if page_token:
+        token_month = decode_page_token(page_token)[0][:7]
+        newest = min(newest, token_month) if newest else token_month
+    for month in list_archive_months():
+        if start and month < start[:7]:
+            break
+        if newest and month > newest:
+            continue
+        where, params = build_log_filters(action, role, user_id, start, end, page_token)
+        conn = _open_archive(month)
+        try:
+            rows.extend(conn.execute(f"""
+                SELECT l.log_id, l.user_id, l.username, l.role, l.action, l.timestamp, l.details
+                FROM logs l
+                {where}
+                ORDER BY l.timestamp DESC, l.log_id DESC
+                LIMIT ?
+            """, params + [page_size + 1 - len(rows)]).fetchall())
+        finally:
+            conn.close()
+        if len(rows) > page_size:
+            break
+    next_token = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_token = encode_page_token(rows[-1]['timestamp'], rows[-1]['log_id'])
+    return {'rows': rows, 'next_token': next_token}
@@ -0,0 +1,252 @@
+import heapq
+import itertools
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import database
+from database import use_database, encode_page_token
+
+# Patients sharded by ID range across SQLite files; users, sessions, settings
+# and the audit log stay in the main database (shard 0). With one shard every
+# call below is a plain pass-through to database.py.
+PATIENT_SHARDS = int(os.environ.get("HMS_PATIENT_SHARDS", "1"))
+SHARD_ID_RANGE = 10_000_000  # shard k hands out patient ids from k * SHARD_ID_RANGE
+FANOUT_WORKERS = 8
+
+_fanout_pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="shard")
+_round_robin = itertools.count()
+_round_robin_lock = threading.Lock()
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def shard_path(shard):
+    """Database file for a shard; shard 0 is the main database"""
+    if shard == 0:
+        return database.DATABASE
+    base, ext = os.path.splitext(database.DATABASE)
+    return f"{base}_shard{shard}{ext or '.db'}"
+
+
+def shard_for_patient(patient_id):
+    """Shard owning a patient id"""
+    shard = int(patient_id) // SHARD_ID_RANGE
+    if not 0 <= shard < PATIENT_SHARDS:
+        raise ValueError(f"Patient {patient_id} is outside the configured shards")
+    return shard
+
+
+def write_shards():
+    """Shards that take new patients; with several, shard 0 is left to the audit log"""
+    return list(range(1, PATIENT_SHARDS)) if PATIENT_SHARDS > 1 else [0]
+
+
+def pick_write_shard(ward=None):
+    """Stable shard for a ward, else round-robin so concurrent registrations use different files"""
+    shards = write_shards()
+    if ward:
+        return shards[zlib.crc32(ward.encode("utf-8")) % len(shards)]
+    with _round_robin_lock:
+        return shards[next(_round_robin) % len(shards)]
+
+
+def init_shards():
+    """Create and migrate every shard and seed its patient id range, once per process"""
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        _init_shards()
+        _initialized = True
+
+
+def _init_shards():
+    database.init_database()
+    for shard in range(1, PATIENT_SHARDS):
+        with use_database(shard_path(shard)):
+            database.init_shard_database()
+            with database.get_db_connection() as conn:
+                floor = shard * SHARD_ID_RANGE
+                # Seeded shards are only read; the write lock is taken once per shard
+                row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'patients'").fetchone()
+                if row is not None and row[0] >= floor:
+                    continue
+                conn.execute("BEGIN IMMEDIATE")
+                updated = conn.execute(
+                    "UPDATE sqlite_sequence SET seq = ? WHERE name = 'patients' AND seq < ?", (floor, floor)
+                ).rowcount
+                exists = conn.execute("SELECT 1 FROM sqlite_sequence WHERE name = 'patients'").fetchone()
+                if not updated and not exists:
+                    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('patients', ?)", (floor,))
+                conn.commit()
+
+
+def on_shard(shard, func, *args, **kwargs):
+    """Call a database.py function against one shard"""
+    with use_database(shard_path(shard)):
+        return func(*args, **kwargs)
+
+
+def fan_out(func, *args, **kwargs):
+    """Call func on every shard in parallel; results in shard order"""
+    if PATIENT_SHARDS == 1:
+        return [func(*args, **kwargs)]
+    futures = [_fanout_pool.submit(on_shard, shard, func, *args, **kwargs) for shard in range(PATIENT_SHARDS)]
+    return [future.result() for future in futures]
+
+
+# ========== ROUTED WRITES ==========
+
+def register_patient(name, contact, diagnosis, cipher=None, ward=None):
+    return on_shard(pick_write_shard(ward), database.register_patient, name, contact, diagnosis, cipher)
+
+
+def update_patient(patient_id, *args):
+    return on_shard(shard_for_patient(patient_id), database.update_patient, patient_id, *args)
+
+
+def import_patients_csv(csv_file, cipher=None, ward=None):
+    """Bulk import into one write shard (the file is streamed once)"""
+    return on_shard(pick_write_shard(ward), database.import_patients_csv, csv_file, cipher)
+
+
+def _combine_batch_results(results):
+    rows = sum(r['rows'] for r in results)
+    seconds = sum(r['seconds'] for r in results)
+    return {'rows': rows, 'seconds': seconds,
+            'rows_per_sec': rows / seconds if seconds > 0 else 0.0,
+            'resumed': any(r.get('resumed') for r in results)}
+
+
+def anonymize_all_patients(cipher, only_dirty=True):
+    """Shard by shard; each run already spreads its chunks over a process pool"""
+    return _combine_batch_results([on_shard(shard, database.anonymize_all_patients, cipher, only_dirty=only_dirty)
+                                   for shard in range(PATIENT_SHARDS)])
+
+
+def reencrypt_all_patients(cipher):
+    return _combine_batch_results([on_shard(shard, database.reencrypt_all_patients, cipher)
+                                   for shard in range(PATIENT_SHARDS)])
+
+
+# ========== FAN-OUT READS ==========
+
+def get_patient_count():
+    return sum(fan_out(database.get_patient_count))
+
+
+def count_dirty_patients():
+    return sum(fan_out(database.count_dirty_patients))
+
+
+def count_patients_pending_reencryption(key_version):
+    return sum(fan_out(database.count_patients_pending_reencryption, key_version))
+
+
+def get_diagnosis_counts():
+    """Patients per diagnosis across shards, largest first"""
+    results = fan_out(database.get_diagnosis_counts)
+    if len(results) == 1:
+        return results[0]
+    totals = {}
+    for rows in results:
+        for row in rows:
+            totals[row['diagnosis']] = totals.get(row['diagnosis'], 0) + row['patient_count']
+    return [{'diagnosis': d, 'patient_count': c}
+            for d, c in sorted(totals.items(), key=lambda item: item[1], reverse=True)]
+
+
+def get_patients_page(page_token=None, page_size=25):
+    """Keyset page merged across shards; tokens are global (date_added, patient_id) positions"""
+    pages = fan_out(database.get_patients_page, page_token, page_size)
+    if len(pages) == 1:
+        return pages[0]
+    key = lambda row: (row['date_added'], row['patient_id'])
+    merged = list(heapq.merge(*(page['rows'] for page in pages), key=key, reverse=True))
+    rows = merged[:page_size]
+    has_more = len(merged) > page_size or any(page['next_token'] for page in pages)
+    next_token = encode_page_token(rows[-1]['date_added'], rows[-1]['patient_id']) if rows and has_more else None
+    return {'rows': rows, 'next_token': next_token, 'total': get_patient_count()}
+
+
+def _merge_patient_frames(frames):
+    """Concatenate per-shard patient frames, newest first"""
+    if len(frames) == 1:
+        return frames[0]
+    merged = pd.concat(frames, ignore_index=True)
+    for name in merged.columns:
+        if database.FRAME_DTYPES.get(name) == 'category' and merged[name].dtype != 'category':
+            merged[name] = merged[name].astype('category')
+    return merged.sort_values('date_added', ascending=False, kind='stable', ignore_index=True)
+
+
+def get_patients_frame(columns=None):
+    """All patients as one typed DataFrame, newest first"""
+    return _merge_patient_frames(fan_out(database.get_patients_frame, columns))
+
+
+def get_patients_snapshot(columns=None):
+    """Uncached frame plus change position, each shard read in its own transaction"""
+    results = fan_out(database.get_patients_snapshot, columns)
+    seqs = [seq for seq, _ in results]
+    frame = _merge_patient_frames([frame for _, frame in results])
+    return (seqs[0] if len(seqs) == 1 else tuple(seqs)), frame
+
+
+def get_patients_frame_by_ids(ids, columns=None):
+    by_shard = {}
+    for patient_id in ids:
+        by_shard.setdefault(shard_for_patient(patient_id), []).append(patient_id)
+    if not by_shard:
+        return on_shard(0, database.get_patients_frame_by_ids, [], columns)
+    frames = [on_shard(shard, database.get_patients_frame_by_ids, shard_ids, columns)
+              for shard, shard_ids in sorted(by_shard.items())]
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+def search_patients(text, role, page=0, page_size=25):
+    """Full-text search on every shard; each shard's ranked hits are interleaved
+
+    bm25 scores are relative to each shard's index, so results alternate
+    between shards' best matches instead of comparing scores.
+    """
+    if PATIENT_SHARDS == 1:
+        return database.search_patients(text, role, page, page_size)
+    page = max(0, int(page))
+    wanted = (page + 1) * page_size + 1
+    results = fan_out(database.search_patients, text, role, 0, wanted)
+    interleaved = [row for group in itertools.zip_longest(*(r['rows'] for r in results))
+                   for row in group if row is not None]
+    start = page * page_size
+    return {'rows': interleaved[start:start + page_size], 'page': page,
+            'has_next': len(interleaved) > start + page_size or any(r['has_next'] for r in results)}
+
+
+# ========== CHANGE FEED ==========
+# A sharded position is the tuple of each shard's change sequence number.
+
+def get_change_seq():
+    seqs = fan_out(database.get_change_seq)
+    return seqs[0] if len(seqs) == 1 else tuple(seqs)
+
+
+def get_changes_since(seq, table):
+    if PATIENT_SHARDS == 1:
+        return database.get_changes_since(seq, table)
+    deltas = [on_shard(shard, database.get_changes_since, shard_seq, table)
+              for shard, shard_seq in enumerate(seq)]
+    return {'seq': tuple(d['seq'] for d in deltas),
+            'upserts': [i for d in deltas for i in d['upserts']],
+            'deletes': [i for d in deltas for i in d['deletes']],
+            'reset': any(d['reset'] for d in deltas)}
+
+
+def count_changes_since(seq, table):
+    if PATIENT_SHARDS == 1:
+        return database.count_changes_since(seq, table)
+    return sum(on_shard(shard, database.count_changes_since, shard_seq, table)
+               for shard, shard_seq in enumerate(seq))